@@ -0,0 +1,214 @@
+import collections
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+
+from prometheus_client import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+MOCK_TENANT_ID = "mock_tenant_1"
+
+TOKEN_VERIFY_SECONDS = Histogram(
+    "tenant_token_verify_seconds",
+    "Signature verification time for tokens not found in the cache",
+    buckets=[0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1],
+)
+TOKEN_CACHE = Counter("tenant_token_cache_total", "Verified-token cache lookups", ["result"])
+TOKEN_REJECTED = Counter("tenant_token_rejected_total", "Tokens that failed verification", ["reason"])
+JWKS_REFRESH = Counter("tenant_jwks_refresh_total", "Signing key refreshes", ["result"])
+
+
+class InvalidToken(Exception):
+    pass
+
+
+class SigningKeyCache:
+    """
+    Signing keys from a JWKS endpoint, kept in memory and refreshed by a
+    background thread, so verification never waits on a key fetch. A token
+    with an unknown `kid` wakes the refresher early (at most once every
+    `min_refresh_interval` seconds) for key rotation.
+    """
+
+    def __init__(self, jwks_url, refresh_interval=300.0, min_refresh_interval=30.0, fetch_timeout=5.0):
+        self.jwks_url = jwks_url
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self.fetch_timeout = fetch_timeout
+        self._keys = {}
+        self._last_refresh = 0.0
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.refresh()
+        self._thread = threading.Thread(target=self._refresh_loop, name="jwks-refresh", daemon=True)
+        self._thread.start()
+
+    def refresh(self):
+        import jwt
+
+        self._last_refresh = time.monotonic()
+        try:
+            with urllib.request.urlopen(self.jwks_url, timeout=self.fetch_timeout) as response:
+                jwks = json.load(response)
+            keys = {}
+            for jwk in jwks.get("keys", []):
+                keys[jwk.get("kid")] = jwt.PyJWK(jwk)
+            self._keys = keys
+            JWKS_REFRESH.labels(result="ok").inc()
+        except Exception:
+            JWKS_REFRESH.labels(result="error").inc()
+            logger.exception(f"failed to refresh signing keys from {self.jwks_url}, keeping {len(self._keys)} cached keys")
+
+    def get(self, kid):
+        key = self._keys.get(kid)
+        if key is None and time.monotonic() - self._last_refresh >= self.min_refresh_interval:
+            self._wake.set()
+        return key
+
+    def _refresh_loop(self):
+        while True:
+            self._wake.wait(self.refresh_interval)
+            self._wake.clear()
+            self.refresh()
+
+
+class VerifiedTokenCache:
+    """LRU of token digest -> (tenant_id, expires_at); entries never outlive the token's own exp."""
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        key = self.digest(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            tenant_id, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return tenant_id
+
+    def put(self, token, tenant_id, expires_at):
+        with self._lock:
+            self._entries[self.digest(token)] = (tenant_id, expires_at)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class TenantAuthenticator:
+    def __init__(self, keys, algorithms, tenant_claim="tenant_id", audience=None, issuer=None,
+                 cache=None, max_cache_seconds=3600.0):
+        self.keys = keys
+        self.algorithms = algorithms
+        self.tenant_claim = tenant_claim
+        self.audience = audience
+        self.issuer = issuer
+        self.cache = cache or VerifiedTokenCache()
+        self.max_cache_seconds = max_cache_seconds
+
+    def verify(self, token):
+        if not token:
+            TOKEN_REJECTED.labels(reason="missing").inc()
+            raise InvalidToken("missing token")
+
+        tenant_id = self.cache.get(token)
+        if tenant_id is not None:
+            TOKEN_CACHE.labels(result="hit").inc()
+            return tenant_id
+        TOKEN_CACHE.labels(result="miss").inc()
+
+        import jwt
+
+        with TOKEN_VERIFY_SECONDS.time():
+            try:
+                kid = jwt.get_unverified_header(token).get("kid")
+                signing_key = self.keys.get(kid)
+                if signing_key is None:
+                    TOKEN_REJECTED.labels(reason="unknown_key").inc()
+                    raise InvalidToken("unknown signing key")
+                claims = jwt.decode(
+                    token,
+                    signing_key.key,
+                    algorithms=self.algorithms,
+                    audience=self.audience,
+                    issuer=self.issuer,
+                    options={"require": ["exp"], "verify_aud": self.audience is not None},
+                )
+            except jwt.PyJWTError as e:
+                TOKEN_REJECTED.labels(reason=type(e).__name__).inc()
+                raise InvalidToken(str(e))
+
+        tenant_id = claims.get(self.tenant_claim)
+        if not tenant_id:
+            TOKEN_REJECTED.labels(reason="missing_tenant").inc()
+            raise InvalidToken(f"token has no {self.tenant_claim} claim")
+
+        self.cache.put(token, tenant_id, min(claims["exp"], time.time() + self.max_cache_seconds))
+        return tenant_id
+
+
+_authenticator = None
+_authenticator_lock = threading.Lock()
+
+
+def get_authenticator():
+    """
+    Built from the environment on first use; None while AUTH_JWKS_URL is
+    unset, in which case every request resolves to the mock tenant.
+    """
+    global _authenticator
+
+    jwks_url = os.getenv("AUTH_JWKS_URL")
+    if not jwks_url:
+        return None
+
+    with _authenticator_lock:
+        if _authenticator is None:
+            keys = SigningKeyCache(
+                jwks_url,
+                refresh_interval=float(os.getenv("AUTH_JWKS_REFRESH_SECONDS", "300")),
+            )
+            keys.start()
+            _authenticator = TenantAuthenticator(
+                keys,
+                algorithms=os.getenv("AUTH_JWT_ALGORITHMS", "RS256").split(","),
+                tenant_claim=os.getenv("AUTH_TENANT_CLAIM", "tenant_id"),
+                audience=os.getenv("AUTH_JWT_AUDIENCE"),
+                issuer=os.getenv("AUTH_JWT_ISSUER"),
+                cache=VerifiedTokenCache(int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))),
+            )
+    return _authenticator
+
+
+def get_tenant_id_from_token(token):
+    """Returns the tenant of a verified token; raises InvalidToken."""
+    authenticator = get_authenticator()
+    if authenticator is None:
+        # mock token parsing
+        return MOCK_TENANT_ID
+    return authenticator.verify(token)
+
+
+def get_token_from_header(authorization):
+    if not authorization:
+        return None
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() == "bearer" and token:
+        return token.strip()
+    return authorization.strip()
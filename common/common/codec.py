@@ -0,0 +1,90 @@
+import json
+import os
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+ZSTD = "zstd"
+
+ENVELOPE_VERSION = 1
+
+# what producers write; consumers decode whatever the message's content_type says
+MESSAGE_CODEC = os.getenv("MESSAGE_CODEC", "msgpack")
+MESSAGE_COMPRESSION = os.getenv("MESSAGE_COMPRESSION", "zstd")
+MESSAGE_COMPRESSION_MIN_SIZE = int(os.getenv("MESSAGE_COMPRESSION_MIN_SIZE", "4096"))
+MESSAGE_ZSTD_LEVEL = int(os.getenv("MESSAGE_ZSTD_LEVEL", "3"))
+
+
+class UnsupportedEncoding(Exception):
+    pass
+
+
+def producer_content_type():
+    """msgpack when configured and installed, JSON otherwise."""
+    if MESSAGE_CODEC == "msgpack" and msgpack is not None:
+        return MSGPACK
+    return JSON
+
+
+def encode_row(row, content_type):
+    if content_type == MSGPACK:
+        return msgpack.packb(row, use_bin_type=True)
+    return json.dumps(row).encode()
+
+
+def encode_envelope(encoded_rows, content_type, fields=None):
+    """
+    {"version": 1, **fields, "rows": [...]} around rows already encoded with
+    encode_row, so a batch is assembled without re-serializing its rows.
+    """
+    fields = {"version": ENVELOPE_VERSION, **(fields or {})}
+    if content_type == MSGPACK:
+        packer = msgpack.Packer(use_bin_type=True)
+        parts = [packer.pack_map_header(len(fields) + 1)]
+        for key, value in fields.items():
+            parts += [packer.pack(key), packer.pack(value)]
+        parts += [packer.pack("rows"), packer.pack_array_header(len(encoded_rows))]
+        return b"".join(parts + list(encoded_rows))
+    return b'%s,"rows":[%s]}' % (json.dumps(fields)[:-1].encode(), b",".join(encoded_rows))
+
+
+def seal(body, content_type):
+    """
+    Compresses large bodies with zstd when enabled and installed. Returns the
+    body and the AMQP content_type/content_encoding properties describing it.
+    """
+    properties = {"content_type": content_type}
+    if MESSAGE_COMPRESSION == ZSTD and zstandard is not None and len(body) >= MESSAGE_COMPRESSION_MIN_SIZE:
+        body = zstandard.ZstdCompressor(level=MESSAGE_ZSTD_LEVEL).compress(body)
+        properties["content_encoding"] = ZSTD
+    return body, properties
+
+
+def encode(message, content_type=None):
+    content_type = content_type or producer_content_type()
+    return seal(encode_row(message, content_type), content_type)
+
+
+def decode(body, content_type=None, content_encoding=None):
+    """Messages without a content_type predate the codec and are plain JSON."""
+    if content_encoding == ZSTD:
+        if zstandard is None:
+            raise UnsupportedEncoding("zstd-compressed message but zstandard is not installed")
+        body = zstandard.ZstdDecompressor().decompress(body)
+    elif content_encoding:
+        raise UnsupportedEncoding(f"unknown content encoding {content_encoding}")
+
+    if content_type == MSGPACK:
+        if msgpack is None:
+            raise UnsupportedEncoding("msgpack message but msgpack is not installed")
+        return msgpack.unpackb(body, raw=False)
+    return json.loads(body)
@@ -0,0 +1,136 @@
+import gzip
+import os
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "application/xml")
+
+
+def available_encodings():
+    """Server preference order; br and zstd only when their optional packages are installed."""
+    encodings = []
+    if zstandard is not None:
+        encodings.append("zstd")
+    if brotli is not None:
+        encodings.append("br")
+    encodings.append("gzip")
+    return encodings
+
+
+def parse_accept_encoding(header):
+    accepted = {}
+    for item in (header or "").split(","):
+        name, _, params = item.strip().partition(";")
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    return accepted
+
+
+def choose_encoding(accept_encoding, encodings):
+    accepted = parse_accept_encoding(accept_encoding)
+    wildcard = accepted.get("*", 0.0)
+    candidates = [e for e in encodings if accepted.get(e, wildcard) > 0]
+    if not candidates:
+        return None
+    # highest client q-value wins, server order breaks ties
+    return max(candidates, key=lambda e: (accepted.get(e, wildcard), -encodings.index(e)))
+
+
+def compress(body, encoding, levels):
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=levels["zstd"]).compress(body)
+    if encoding == "br":
+        return brotli.compress(body, quality=levels["br"])
+    return gzip.compress(body, compresslevel=levels["gzip"], mtime=0)
+
+
+class CompressionMiddleware:
+    """
+    Compresses complete (non-streaming) responses with the best encoding the
+    client accepts: zstd, br or gzip. Small bodies, non-text content types
+    and responses that already carry a Content-Encoding pass through as-is.
+    Large bodies are compressed off the event loop.
+
+    Tuned by COMPRESSION_MIN_SIZE, COMPRESSION_THREADPOOL_MIN_SIZE and
+    COMPRESSION_{GZIP,BR,ZSTD}_LEVEL.
+    """
+
+    def __init__(self, app, minimum_size=None, threadpool_minimum_size=None, levels=None):
+        self.app = app
+        self.minimum_size = minimum_size or int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+        self.threadpool_minimum_size = threadpool_minimum_size or int(os.getenv("COMPRESSION_THREADPOOL_MIN_SIZE", str(256 * 1024)))
+        self.levels = levels or {
+            "gzip": int(os.getenv("COMPRESSION_GZIP_LEVEL", "6")),
+            "br": int(os.getenv("COMPRESSION_BR_LEVEL", "4")),
+            "zstd": int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3")),
+        }
+        self.encodings = available_encodings()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding"), self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start_message, passthrough
+
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            headers = MutableHeaders(raw=start_message["headers"])
+            body = message.get("body", b"")
+            content_type = headers.get("content-type", "")
+            if (
+                message.get("more_body", False)
+                or "content-encoding" in headers
+                or len(body) < self.minimum_size
+                or not content_type.startswith(COMPRESSIBLE_TYPES)
+            ):
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            if len(body) >= self.threadpool_minimum_size:
+                body = await run_in_threadpool(compress, body, encoding, self.levels)
+            else:
+                body = compress(body, encoding, self.levels)
+
+            headers["content-encoding"] = encoding
+            headers["content-length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start_message)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,169 @@
+import json
+import os
+import sqlite3
+import time
+
+# shared by storage-service, insertion-service and sync-consumer-service through the job_state volume
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    tenant_id TEXT NOT NULL,
+    file_name TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    parsed_at REAL,
+    updated_at REAL NOT NULL,
+    rows_parsed INTEGER NOT NULL DEFAULT 0,
+    rows_published INTEGER NOT NULL DEFAULT 0,
+    rows_embedded INTEGER NOT NULL DEFAULT 0,
+    rows_stored INTEGER NOT NULL DEFAULT 0,
+    rows_skipped INTEGER NOT NULL DEFAULT 0,
+    rows_failed INTEGER NOT NULL DEFAULT 0,
+    header TEXT,
+    checkpoint_offset INTEGER NOT NULL DEFAULT 0,
+    shards_done TEXT NOT NULL DEFAULT '[]'
+)
+"""
+
+QUEUED = "queued"
+PARSING = "parsing"
+PARSED = "parsed"
+FAILED = "failed"
+
+COUNTERS = ("rows_parsed", "rows_published", "rows_embedded", "rows_stored", "rows_skipped", "rows_failed")
+
+# columns added after the table was first shipped, created on databases that predate them
+ADDED_COLUMNS = {
+    "rows_failed": "INTEGER NOT NULL DEFAULT 0",
+}
+
+
+class JobRegistry:
+    """
+    Ingest job progress in a local SQLite database: row counts for every
+    stage, and the checkpoint a crashed parse resumes from. Each call uses
+    its own short-lived connection, so the registry is safe to share
+    between threads and processes.
+    """
+
+    def __init__(self, path=JOBS_DB_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(SCHEMA)
+            existing = {row["name"] for row in db.execute("PRAGMA table_info(jobs)")}
+            for name, definition in ADDED_COLUMNS.items():
+                if name in existing:
+                    continue
+                try:
+                    db.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+                except sqlite3.OperationalError as e:
+                    # another service added it first
+                    if "duplicate column" not in str(e):
+                        raise
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def _update(self, job_id, assignments, *params):
+        with self._connect() as db:
+            db.execute(f"UPDATE jobs SET {assignments}, updated_at = ? WHERE job_id = ?", (*params, time.time(), job_id))
+
+    def create(self, job_id, tenant_id, file_name):
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR IGNORE INTO jobs (job_id, tenant_id, file_name, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, tenant_id, file_name, QUEUED, now, now),
+            )
+
+    def get(self, job_id):
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["header"] = json.loads(job["header"]) if job["header"] else None
+        job["shards_done"] = json.loads(job["shards_done"])
+        return job
+
+    def start(self, job_id, tenant_id, file_name=None):
+        """Marks the job as parsing (creating it for jobs queued before the registry existed)."""
+        self.create(job_id, tenant_id, file_name)
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, error = NULL, started_at = COALESCE(started_at, ?), updated_at = ? WHERE job_id = ? AND status != ?",
+                (PARSING, now, now, job_id, PARSED),
+            )
+        return self.get(job_id)
+
+    def set_header(self, job_id, header):
+        self._update(job_id, "header = ?", json.dumps(header))
+
+    def checkpoint(self, job_id, offset, rows):
+        """Everything before byte `offset`, `rows` rows in all, is confirmed by the broker."""
+        self._update(job_id, "checkpoint_offset = ?, rows_parsed = ?, rows_published = ?", offset, rows, rows)
+
+    def complete_shard(self, job_id, shard, rows):
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET shards_done = json_insert(shards_done, '$[#]', json(?)),"
+                " rows_parsed = rows_parsed + ?, rows_published = rows_published + ?, updated_at = ? WHERE job_id = ?",
+                (json.dumps(list(shard)), rows, rows, time.time(), job_id),
+            )
+
+    def add_counts(self, job_id, **counts):
+        """Increments stage counters, e.g. add_counts(job_id, rows_embedded=500)."""
+        names = [name for name in counts if name in COUNTERS]
+        if not names:
+            return
+        self._update(job_id, ", ".join(f"{name} = {name} + ?" for name in names), *(counts[name] for name in names))
+
+    def finish(self, job_id, rows=None, error=None):
+        if error is not None:
+            self._update(job_id, "status = ?, error = ?", FAILED, str(error))
+        elif rows is not None:
+            self._update(job_id, "status = ?, parsed_at = ?, rows_parsed = ?, rows_published = ?", PARSED, time.time(), rows, rows)
+        else:
+            self._update(job_id, "status = ?, parsed_at = ?", PARSED, time.time())
+
+
+def progress(job):
+    """The job record as reported by the status API, with throughput figures."""
+    now = time.time()
+    started_at = job["started_at"]
+    synced = job["rows_stored"] + job["rows_skipped"]
+    report = {key: job[key] for key in (
+        "job_id", "tenant_id", "file_name", "status", "error", "created_at", "started_at", "parsed_at",
+        "updated_at", *COUNTERS, "checkpoint_offset",
+    )}
+    report["rows_pending_sync"] = max(job["rows_published"] - synced - job["rows_failed"], 0)
+    report["synced"] = job["status"] == PARSED and synced >= job["rows_published"]
+    if started_at:
+        parse_seconds = (job["parsed_at"] or now) - started_at
+        sync_seconds = (job["updated_at"] if report["synced"] else now) - started_at
+        report["rows_per_second"] = {
+            "parse": round(job["rows_published"] / parse_seconds, 1) if parse_seconds > 0 else None,
+            "sync": round(synced / sync_seconds, 1) if sync_seconds > 0 else None,
+        }
+    return report
+
+
+_registry = None
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        _registry = JobRegistry()
+    return _registry
@@ -0,0 +1,131 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+
+DEFAULT_SAMPLE_RATES = {"DEBUG": 1.0, "INFO": 1.0}
+
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sample_rate"}
+
+_listener = None
+_queue_handler = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, which is what promtail/Loki expect."""
+
+    def __init__(self, service=None):
+        super().__init__()
+        self.service = service
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if self.service:
+            entry["service"] = self.service
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a fraction of records per level (WARNING and above are never sampled
+    unless configured). A record can override its level's rate with
+    `extra={"sample_rate": 0.01}`, which is how hot-path events opt in.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = rates if rates is not None else DEFAULT_SAMPLE_RATES
+
+    def filter(self, record):
+        rate = getattr(record, "sample_rate", None)
+        if rate is None:
+            rate = self.rates.get(record.levelname, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the listener thread without ever blocking the caller.
+    Formatting and I/O happen on the listener; when the queue is full the
+    record is dropped and counted instead.
+    """
+
+    dropped = 0
+
+    def prepare(self, record):
+        # only resolve what can't cross threads safely; JSON formatting is left to the listener
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+
+def parse_sample_rates(value):
+    rates = dict(DEFAULT_SAMPLE_RATES)
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        level, rate = item.split("=", 1)
+        rates[level.strip().upper()] = float(rate)
+    return rates
+
+
+def setup_logger(name=None, log_file=None, service=None):
+    """
+    Configures the root logger once with a queue-backed JSON pipeline:
+    callers only enqueue, a QueueListener thread formats and writes to stdout
+    and, if given, `log_file`. Returns `logging.getLogger(name)`.
+
+    LOG_LEVEL, LOG_SAMPLE_RATES (e.g. "DEBUG=0.01,INFO=0.5") and LOG_QUEUE_SIZE
+    tune it from the environment.
+    """
+    global _listener, _queue_handler
+
+    if _listener is None:
+        formatter = JsonFormatter(service=service or os.getenv("OTEL_SERVICE_NAME"))
+        handlers = [logging.StreamHandler(sys.stdout)]
+        if log_file:
+            os.makedirs(os.path.dirname(log_file), exist_ok=True)
+            handlers.append(logging.FileHandler(log_file))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        log_queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+        _queue_handler = NonBlockingQueueHandler(log_queue)
+        _queue_handler.addFilter(SamplingFilter(parse_sample_rates(os.getenv("LOG_SAMPLE_RATES"))))
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+        root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+    return logging.getLogger(name)
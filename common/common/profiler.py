@@ -0,0 +1,203 @@
+import collections
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+
+DEFAULT_SAMPLE_INTERVAL = 0.005
+MAX_PROFILE_SECONDS = 60
+
+logger = logging.getLogger(__name__)
+
+_profile_lock = threading.Lock()
+_memory_baseline = None
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _stack_of(frame):
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+def sample_cpu(seconds, interval=DEFAULT_SAMPLE_INTERVAL):
+    """
+    Samples the stacks of every other thread for `seconds` and returns a
+    Counter of stack tuples (root first) to the number of samples seen.
+    """
+    seconds = min(max(float(seconds), 0.1), MAX_PROFILE_SECONDS)
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("a CPU profile is already running")
+
+    try:
+        own_id = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        samples = collections.Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                thread_name = names.get(thread_id, str(thread_id))
+                samples[(f"thread {thread_name}",) + _stack_of(frame)] += 1
+            time.sleep(interval)
+        return samples
+    finally:
+        _profile_lock.release()
+
+
+def to_collapsed(samples):
+    """Brendan Gregg's folded stack format, readable by flamegraph.pl and speedscope."""
+    return "\n".join(f"{';'.join(stack)} {count}" for stack, count in samples.most_common())
+
+
+def to_speedscope(samples, interval=DEFAULT_SAMPLE_INTERVAL, name="cpu profile"):
+    frames = []
+    frame_index = {}
+    profile_samples = []
+    weights = []
+
+    for stack, count in samples.items():
+        indexes = []
+        for label in stack:
+            if label not in frame_index:
+                frame_index[label] = len(frames)
+                frames.append({"name": label})
+            indexes.append(frame_index[label])
+        profile_samples.append(indexes)
+        weights.append(count * interval)
+
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "seconds",
+            "startValue": 0,
+            "endValue": sum(weights),
+            "samples": profile_samples,
+            "weights": weights,
+        }],
+        "name": name,
+        "exporter": "profiler.py",
+    }
+
+
+def profile_cpu(seconds, output_format="speedscope", interval=DEFAULT_SAMPLE_INTERVAL):
+    samples = sample_cpu(seconds, interval=interval)
+    if output_format == "collapsed":
+        return to_collapsed(samples)
+    return to_speedscope(samples, interval=interval)
+
+
+def memory_snapshot(limit=25, diff=False, key_type="lineno"):
+    """
+    Returns the top `limit` allocation sites. Tracing is started on the first
+    call, so the first snapshot only covers allocations made after it.
+    With `diff` the result is relative to the previous snapshot taken here.
+    """
+    global _memory_baseline
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(int(os.getenv("TRACEMALLOC_FRAMES", "1")))
+
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+
+    if diff and _memory_baseline is not None:
+        stats = snapshot.compare_to(_memory_baseline, key_type)[:limit]
+        top = [{
+            "location": str(stat.traceback),
+            "size_bytes": stat.size,
+            "size_diff_bytes": stat.size_diff,
+            "count": stat.count,
+            "count_diff": stat.count_diff,
+        } for stat in stats]
+    else:
+        stats = snapshot.statistics(key_type)[:limit]
+        top = [{
+            "location": str(stat.traceback),
+            "size_bytes": stat.size,
+            "count": stat.count,
+        } for stat in stats]
+
+    _memory_baseline = snapshot
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        "traced_current_bytes": current,
+        "traced_peak_bytes": peak,
+        "diff": diff,
+        "top": top,
+    }
+
+
+def stop_memory_tracing():
+    global _memory_baseline
+    _memory_baseline = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def _write_profile(output_dir, kind, content):
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"{kind}-{os.getpid()}-{int(time.time())}")
+    if isinstance(content, str):
+        path += ".folded"
+        with open(path, "w") as f:
+            f.write(content)
+    else:
+        path += ".json"
+        with open(path, "w") as f:
+            json.dump(content, f)
+    logger.info(f"[profiler] wrote {path}")
+    return path
+
+
+def install_signal_handlers(output_dir=None, seconds=None, output_format=None):
+    """
+    Lets a running consumer be profiled without a redeploy:
+      kill -USR1 <pid>  -> CPU profile for PROFILE_SECONDS, written to PROFILE_DIR
+      kill -USR2 <pid>  -> tracemalloc top-N, diffed against the previous USR2
+    Profiles are taken on a background thread so the consumer keeps running.
+    """
+    output_dir = output_dir or os.getenv("PROFILE_DIR", "/tmp/profiles")
+    seconds = seconds or float(os.getenv("PROFILE_SECONDS", "30"))
+    output_format = output_format or os.getenv("PROFILE_FORMAT", "speedscope")
+    limit = int(os.getenv("PROFILE_MEMORY_TOP", "25"))
+
+    def run_cpu_profile():
+        try:
+            result = profile_cpu(seconds, output_format=output_format)
+            _write_profile(output_dir, "cpu", result)
+        except Exception:
+            logger.exception("[profiler] cpu profile failed")
+
+    def run_memory_snapshot():
+        try:
+            result = memory_snapshot(limit=limit, diff=True)
+            _write_profile(output_dir, "memory", result)
+        except Exception:
+            logger.exception("[profiler] memory snapshot failed")
+
+    def on_usr1(signum, frame):
+        threading.Thread(target=run_cpu_profile, name="cpu-profiler", daemon=True).start()
+
+    def on_usr2(signum, frame):
+        threading.Thread(target=run_memory_snapshot, name="memory-profiler", daemon=True).start()
+
+    signal.signal(signal.SIGUSR1, on_usr1)
+    signal.signal(signal.SIGUSR2, on_usr2)
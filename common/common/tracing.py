@@ -0,0 +1,202 @@
+import collections
+import logging
+import os
+import threading
+
+from opentelemetry import trace
+from opentelemetry.sdk.resources import SERVICE_NAME, Resource
+from opentelemetry.sdk.trace import SpanProcessor, TracerProvider
+from opentelemetry.sdk.trace.export import SpanExportResult
+from opentelemetry.sdk.trace.sampling import (
+    Decision,
+    ParentBased,
+    Sampler,
+    SamplingResult,
+    TraceIdRatioBased,
+)
+from opentelemetry.trace import StatusCode
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+SPANS_EXPORTED = Counter("otel_spans_exported_total", "Spans successfully handed to the OTLP exporter")
+SPANS_DROPPED = Counter("otel_spans_dropped_total", "Spans that were recorded but not exported", ["reason"])
+TRACES_TAIL_KEPT = Counter("otel_traces_tail_kept_total", "Unsampled traces kept by tail capture", ["reason"])
+
+
+class RecordOnlySampler(Sampler):
+    """Records spans without setting the sampled flag, so the tail processor can still decide."""
+
+    def should_sample(self, parent_context, trace_id, name, kind=None, attributes=None, links=None, trace_state=None):
+        parent_span_context = trace.get_current_span(parent_context).get_span_context()
+        return SamplingResult(Decision.RECORD_ONLY, attributes=None, trace_state=parent_span_context.trace_state)
+
+    def get_description(self):
+        return "RecordOnlySampler"
+
+
+class RatioOrRecordSampler(Sampler):
+    """TraceIdRatioBased for the head decision, but traces it rejects are recorded instead of dropped."""
+
+    def __init__(self, ratio):
+        self._ratio_sampler = TraceIdRatioBased(ratio)
+
+    def should_sample(self, parent_context, trace_id, name, kind=None, attributes=None, links=None, trace_state=None):
+        result = self._ratio_sampler.should_sample(
+            parent_context, trace_id, name, kind=kind, attributes=attributes, links=links, trace_state=trace_state,
+        )
+        if result.decision == Decision.DROP:
+            return SamplingResult(Decision.RECORD_ONLY, attributes=None, trace_state=result.trace_state)
+        return result
+
+    def get_description(self):
+        return f"RatioOrRecord{{{self._ratio_sampler.get_description()}}}"
+
+
+class TailSamplingSpanProcessor(SpanProcessor):
+    """
+    Exports head-sampled spans as they end. Recorded-but-unsampled spans are
+    buffered per trace until the local root span ends, and the whole trace is
+    exported only if the root took longer than `latency_threshold` seconds or
+    any of its spans ended with an error status. Everything else is dropped
+    without ever reaching the exporter.
+    """
+
+    def __init__(self, exporter, latency_threshold, max_buffered_traces=2048, max_queue_size=4096,
+                 max_export_batch_size=512, schedule_delay=5.0):
+        self._exporter = exporter
+        self._latency_threshold_ns = int(latency_threshold * 1e9)
+        self._max_buffered_traces = max_buffered_traces
+        self._max_queue_size = max_queue_size
+        self._max_export_batch_size = max_export_batch_size
+        self._schedule_delay = schedule_delay
+
+        self._buffer = collections.OrderedDict()
+        self._buffer_lock = threading.Lock()
+        self._queue = collections.deque()
+        self._condition = threading.Condition()
+        self._shutdown = False
+        self._worker = threading.Thread(target=self._export_loop, name="TailSamplingSpanProcessor", daemon=True)
+        self._worker.start()
+
+    def on_start(self, span, parent_context=None):
+        pass
+
+    def on_end(self, span):
+        if self._shutdown:
+            return
+
+        span_context = span.context
+        if span_context.trace_flags.sampled:
+            self._enqueue([span])
+            return
+
+        trace_id = span_context.trace_id
+        with self._buffer_lock:
+            spans = self._buffer.get(trace_id)
+            if spans is None:
+                spans = self._buffer[trace_id] = []
+                if len(self._buffer) > self._max_buffered_traces:
+                    _, evicted = self._buffer.popitem(last=False)
+                    SPANS_DROPPED.labels(reason="buffer_full").inc(len(evicted))
+            spans.append(span)
+
+            is_local_root = span.parent is None or span.parent.is_remote
+            if not is_local_root:
+                return
+            spans = self._buffer.pop(trace_id, spans)
+
+        keep_reason = self._keep_reason(span, spans)
+        if keep_reason is None:
+            SPANS_DROPPED.labels(reason="not_sampled").inc(len(spans))
+            return
+        TRACES_TAIL_KEPT.labels(reason=keep_reason).inc()
+        self._enqueue(spans)
+
+    def _keep_reason(self, root, spans):
+        if any(s.status.status_code == StatusCode.ERROR for s in spans):
+            return "error"
+        if root.end_time - root.start_time >= self._latency_threshold_ns:
+            return "latency"
+        return None
+
+    def _enqueue(self, spans):
+        with self._condition:
+            free = self._max_queue_size - len(self._queue)
+            if free < len(spans):
+                SPANS_DROPPED.labels(reason="queue_full").inc(len(spans) - max(free, 0))
+                spans = spans[:max(free, 0)]
+            self._queue.extend(spans)
+            if len(self._queue) >= self._max_export_batch_size:
+                self._condition.notify()
+
+    def _export_loop(self):
+        while True:
+            with self._condition:
+                if not self._shutdown and len(self._queue) < self._max_export_batch_size:
+                    self._condition.wait(self._schedule_delay)
+                if self._shutdown and not self._queue:
+                    return
+            self._export_pending()
+
+    def _export_pending(self):
+        while True:
+            with self._condition:
+                batch = [self._queue.popleft() for _ in range(min(len(self._queue), self._max_export_batch_size))]
+            if not batch:
+                return
+            try:
+                result = self._exporter.export(batch)
+            except Exception:
+                logger.exception("span export failed")
+                result = SpanExportResult.FAILURE
+            if result == SpanExportResult.SUCCESS:
+                SPANS_EXPORTED.inc(len(batch))
+            else:
+                SPANS_DROPPED.labels(reason="export_failed").inc(len(batch))
+
+    def force_flush(self, timeout_millis=30000):
+        self._export_pending()
+        return True
+
+    def shutdown(self):
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify()
+        self._worker.join()
+        self._exporter.shutdown()
+
+
+def build_sampler(ratio, tail_enabled):
+    if not tail_enabled:
+        return ParentBased(root=TraceIdRatioBased(ratio))
+    record_only = RecordOnlySampler()
+    return ParentBased(
+        root=RatioOrRecordSampler(ratio),
+        remote_parent_not_sampled=record_only,
+        local_parent_not_sampled=record_only,
+    )
+
+
+def setup_tracing(service_name, endpoint):
+    """
+    Installs the global tracer provider. Configured through:
+      OTEL_TRACES_SAMPLER_ARG  head sampling ratio for new traces (default 1.0)
+      TRACE_TAIL_ENABLED       keep slow/errored traces that lost the head decision (default true)
+      TRACE_TAIL_LATENCY_MS    latency above which a trace is always kept (default 1000)
+    """
+    # deferred: the exporter pulls in protobuf and requests
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+    ratio = float(os.getenv("OTEL_TRACES_SAMPLER_ARG", "1.0"))
+    tail_enabled = os.getenv("TRACE_TAIL_ENABLED", "true").lower() == "true"
+    latency_threshold = float(os.getenv("TRACE_TAIL_LATENCY_MS", "1000")) / 1000
+
+    resource = Resource(attributes={SERVICE_NAME: service_name})
+    trace_provider = TracerProvider(resource=resource, sampler=build_sampler(ratio, tail_enabled))
+    span_processor = TailSamplingSpanProcessor(OTLPSpanExporter(endpoint=endpoint), latency_threshold)
+    trace_provider.add_span_processor(span_processor)
+    trace.set_tracer_provider(trace_provider)
+
+    logger.info(f"tracing {service_name}: ratio={ratio} tail={tail_enabled} threshold={latency_threshold}s")
+    return trace_provider
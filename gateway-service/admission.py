@@ -0,0 +1,149 @@
+import asyncio
+import collections
+import contextlib
+import math
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+
+ADMISSION_DECISIONS = Counter("gateway_admission_total", "Admission decisions", ["decision"])
+ADMISSION_QUEUE_DEPTH = Gauge("gateway_admission_queue_depth", "Requests waiting for a concurrency slot")
+ADMISSION_ACTIVE = Gauge("gateway_admission_active", "Admitted requests currently executing")
+ADMISSION_WAIT = Histogram(
+    "gateway_admission_wait_seconds",
+    "Time admitted requests spent queued for a concurrency slot",
+    buckets=[0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2],
+)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def retry_after_header(self):
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def try_acquire(self):
+        """Returns 0 when a token was taken, otherwise the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """
+    Per-tenant token buckets in front of a global concurrency cap.
+
+    A request first spends a token from its tenant's bucket. It then either
+    takes one of `max_concurrency` slots or waits in a short FIFO queue.
+    Requests are shed immediately with a Retry-After hint when the queue is
+    full or when the estimated wait (queue position x average service time /
+    slots) would already exceed `latency_slo`. Shedding at the door keeps the
+    latency of admitted requests bounded instead of letting queues grow.
+    """
+
+    def __init__(self, tenant_rate, tenant_burst, max_concurrency, max_queue, latency_slo, max_tenants=10000):
+        self.tenant_rate = tenant_rate
+        self.tenant_burst = tenant_burst
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.latency_slo = latency_slo
+        self.max_tenants = max_tenants
+
+        self._buckets = collections.OrderedDict()
+        self._active = 0
+        self._waiters = collections.deque()
+        self._avg_service_time = 0.1
+
+    def check_rate(self, tenant_id):
+        # unknown tenant: only the global concurrency cap applies
+        if tenant_id is None:
+            return
+        bucket = self._buckets.get(tenant_id)
+        if bucket is None:
+            bucket = self._buckets[tenant_id] = TokenBucket(self.tenant_rate, self.tenant_burst)
+            if len(self._buckets) > self.max_tenants:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(tenant_id)
+
+        retry_after = bucket.try_acquire()
+        if retry_after > 0:
+            ADMISSION_DECISIONS.labels(decision="rate_limited").inc()
+            raise AdmissionRejected("tenant rate limit exceeded", retry_after)
+
+    def estimated_wait(self):
+        return (len(self._waiters) + 1) * self._avg_service_time / self.max_concurrency
+
+    async def acquire(self):
+        if self._active < self.max_concurrency and not self._waiters:
+            self._active += 1
+            ADMISSION_ACTIVE.set(self._active)
+            return
+
+        estimated_wait = self.estimated_wait()
+        if len(self._waiters) >= self.max_queue or estimated_wait > self.latency_slo:
+            ADMISSION_DECISIONS.labels(decision="shed").inc()
+            raise AdmissionRejected("server overloaded", estimated_wait)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        ADMISSION_QUEUE_DEPTH.set(len(self._waiters))
+        start_time = time.monotonic()
+        try:
+            # the slot is handed over by release(), so _active already counts us
+            await asyncio.wait_for(waiter, timeout=self.latency_slo)
+        except asyncio.TimeoutError:
+            ADMISSION_DECISIONS.labels(decision="shed").inc()
+            raise AdmissionRejected("server overloaded", self.estimated_wait())
+        except asyncio.CancelledError:
+            # cancelled right after being handed a slot: give it to the next waiter
+            if waiter.done() and not waiter.cancelled():
+                self._hand_over_slot()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            ADMISSION_QUEUE_DEPTH.set(len(self._waiters))
+        ADMISSION_WAIT.observe(time.monotonic() - start_time)
+
+    def release(self, service_time):
+        # exponentially weighted so the wait estimate follows current upstream latency
+        self._avg_service_time = 0.9 * self._avg_service_time + 0.1 * service_time
+        self._hand_over_slot()
+
+    def _hand_over_slot(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                ADMISSION_QUEUE_DEPTH.set(len(self._waiters))
+                return
+        self._active -= 1
+        ADMISSION_ACTIVE.set(self._active)
+
+    @contextlib.asynccontextmanager
+    async def admit(self, tenant_id):
+        """Rate-limits and holds a concurrency slot for the body of the `async with`; raises AdmissionRejected."""
+        self.check_rate(tenant_id)
+        await self.acquire()
+        ADMISSION_DECISIONS.labels(decision="admitted").inc()
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start_time)
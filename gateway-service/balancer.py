@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import os
+import random
+import time
+
+import httpx
+from prometheus_client import Counter, Gauge
+
+from upstream import create_client
+
+logger = logging.getLogger(__name__)
+
+REPLICA_HEALTHY = Gauge("gateway_upstream_replica_healthy", "1 if the replica is in rotation", ["upstream", "replica"])
+REPLICA_OUTSTANDING = Gauge("gateway_upstream_replica_outstanding", "Requests in flight to the replica", ["upstream", "replica"])
+REPLICA_EJECTIONS = Counter("gateway_upstream_replica_ejections_total", "Times a replica was taken out of rotation", ["upstream", "replica"])
+
+
+class Replica:
+    def __init__(self, upstream, url, client):
+        self.upstream = upstream
+        self.url = url
+        self.client = client
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        # joins the rotation once its first readiness probe succeeds
+        self.healthy = False
+        self.ejected_until = 0.0
+        REPLICA_HEALTHY.labels(upstream, url).set(0)
+
+    def record_success(self):
+        self.consecutive_failures = 0
+
+    def record_failure(self, eject_after, eject_seconds):
+        self.consecutive_failures += 1
+        if self.healthy and self.consecutive_failures >= eject_after:
+            self.healthy = False
+            self.ejected_until = time.monotonic() + eject_seconds
+            REPLICA_EJECTIONS.labels(self.upstream, self.url).inc()
+            REPLICA_HEALTHY.labels(self.upstream, self.url).set(0)
+            logger.warning(f"ejected {self.url} after {self.consecutive_failures} consecutive failures")
+
+    def mark_unready(self):
+        """Out of rotation until its readiness probe passes again, with no ejection window."""
+        if self.healthy:
+            logger.warning(f"{self.url} reports not ready, taking it out of rotation")
+            self.healthy = False
+            self.ejected_until = 0.0
+            REPLICA_HEALTHY.labels(self.upstream, self.url).set(0)
+
+    def reinstate(self):
+        if not self.healthy:
+            logger.info(f"{self.url} is back in rotation")
+        self.healthy = True
+        self.consecutive_failures = 0
+        REPLICA_HEALTHY.labels(self.upstream, self.url).set(1)
+
+
+class ReplicaPool:
+    """
+    Power-of-two-choices balancing over the replicas of one upstream: pick
+    two healthy replicas at random and send the request to the one with
+    fewer requests in flight. Replicas are ejected after `eject_after`
+    consecutive errors (transport errors or 5xx) and are only put back once
+    `eject_seconds` have passed and an active health probe succeeds. The
+    probe hits a readiness endpoint: a replica answering 503 there (still
+    warming up) is out of rotation until it reports ready.
+    """
+
+    def __init__(self, name, urls, config, health_path="/ready", probe_interval=5.0,
+                 probe_timeout=2.0, eject_after=3, eject_seconds=30.0):
+        self.name = name
+        self.urls = urls
+        self.config = config
+        self.health_path = health_path
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.replicas = []
+        self._probe_task = None
+
+    async def start(self):
+        self.replicas = [Replica(self.name, url, create_client(dict(self.config, url=url))) for url in self.urls]
+        self._probe_task = asyncio.create_task(self._probe_loop())
+
+    async def close(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+        for replica in self.replicas:
+            await replica.client.aclose()
+
+    def pick(self, exclude=()):
+        candidates = [r for r in self.replicas if r.healthy and r not in exclude]
+        if not candidates:
+            # fail open: better to try an ejected replica than to reject everything
+            candidates = [r for r in self.replicas if r not in exclude] or self.replicas
+        if len(candidates) == 1:
+            return candidates[0]
+        first, second = random.sample(candidates, 2)
+        return first if first.outstanding <= second.outstanding else second
+
+    async def request(self, method, path, retries=1, stream=False, **kwargs):
+        """
+        Sends the request to a picked replica. Requests that fail to connect
+        never reached a replica, so they are retried on another one.
+        With `stream` the body is left unread (and undecoded); the caller
+        must close the response.
+        """
+        tried = []
+        while True:
+            replica = self.pick(exclude=tried)
+            tried.append(replica)
+            replica.outstanding += 1
+            REPLICA_OUTSTANDING.labels(self.name, replica.url).inc()
+            try:
+                if stream:
+                    response = await replica.client.send(replica.client.build_request(method, path, **kwargs), stream=True)
+                else:
+                    response = await replica.client.request(method, path, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                replica.record_failure(self.eject_after, self.eject_seconds)
+                if len(tried) > retries or len(tried) >= len(self.replicas):
+                    raise
+                continue
+            except httpx.TransportError:
+                replica.record_failure(self.eject_after, self.eject_seconds)
+                raise
+            finally:
+                replica.outstanding -= 1
+                REPLICA_OUTSTANDING.labels(self.name, replica.url).dec()
+
+            if response.status_code >= 500:
+                replica.record_failure(self.eject_after, self.eject_seconds)
+            else:
+                replica.record_success()
+            return response
+
+    async def _probe(self, replica):
+        try:
+            response = await replica.client.get(self.health_path, timeout=self.probe_timeout)
+            ok = response.status_code == 200
+            unready = response.status_code == 503
+        except httpx.HTTPError:
+            ok = unready = False
+
+        if unready:
+            replica.mark_unready()
+        elif not ok:
+            replica.record_failure(self.eject_after, self.eject_seconds)
+        elif replica.healthy:
+            replica.record_success()
+        elif time.monotonic() >= replica.ejected_until:
+            replica.reinstate()
+
+    async def _probe_loop(self):
+        while True:
+            await asyncio.gather(*(self._probe(replica) for replica in self.replicas))
+            await asyncio.sleep(self.probe_interval)
+
+
+def replica_pool_from_env(prefix, config):
+    """
+    <PREFIX>_URLS is a comma-separated replica list (falls back to the single
+    <PREFIX>_URL); <PREFIX>_HEALTH_PATH, _PROBE_INTERVAL, _EJECT_AFTER and
+    _EJECT_SECONDS tune health checking.
+    """
+    urls = [url.strip() for url in os.getenv(f"{prefix}_URLS", config["url"]).split(",") if url.strip()]
+    return ReplicaPool(
+        prefix.lower(),
+        urls,
+        config,
+        health_path=os.getenv(f"{prefix}_HEALTH_PATH", "/ready"),
+        probe_interval=float(os.getenv(f"{prefix}_PROBE_INTERVAL", "5")),
+        eject_after=int(os.getenv(f"{prefix}_EJECT_AFTER", "3")),
+        eject_seconds=float(os.getenv(f"{prefix}_EJECT_SECONDS", "30")),
+    )
@@ -1,58 +1,133 @@
 import os
-import requests
-import logging
-from fastapi import FastAPI, File, UploadFile
+import time
+import asyncio
+import httpx
+from fastapi import FastAPI, Request
 
 from typing import List, Optional
 from fastapi import  Query
 from pydantic import BaseModel
 
+from fastapi.responses import Response, JSONResponse
 from opentelemetry import trace
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
-from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
-from opentelemetry.instrumentation.requests import RequestsInstrumentor
-from opentelemetry.sdk.resources import SERVICE_NAME, Resource
+from opentelemetry.instrumentation.httpx import HTTPXClientInstrumentor
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from common.logging_conf import setup_logger
+from common.tracing import setup_tracing
+from common.compression import CompressionMiddleware
+from upstream import upstream_config, create_client
+from balancer import replica_pool_from_env
+from admission import AdmissionController, AdmissionRejected
+from common.auth import InvalidToken, get_authenticator, get_tenant_id_from_token, get_token_from_header
 
 # --- Configuration ---
-# MAIN_SERVICE_URL=os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://main-service:8000")
-MAIN_SERVICE_URL="http://main-service:8000"
-STORAGE_SERVICE_URL="http://storage-service:8001"
+MAIN_SERVICE = upstream_config("MAIN_SERVICE", "http://main-service:8000", default_timeout="30")
+STORAGE_SERVICE = upstream_config("STORAGE_SERVICE", "http://storage-service:8001", default_timeout="300")
+STORAGE_SERVICE_URL = STORAGE_SERVICE["url"]
 OTEL_EXPORTER_OTLP_ENDPOINT = "http://jaeger:4318/v1/traces"
 OTEL_SERVICE_NAME = "gateway-service"
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 ** 3)))
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+# --- Admission Control ---
+admission = AdmissionController(
+    tenant_rate=float(os.getenv("TENANT_RATE_LIMIT_RPS", "10")),
+    tenant_burst=float(os.getenv("TENANT_RATE_LIMIT_BURST", "20")),
+    max_concurrency=int(os.getenv("MAX_CONCURRENT_REQUESTS", "64")),
+    max_queue=int(os.getenv("MAX_QUEUED_REQUESTS", "128")),
+    latency_slo=float(os.getenv("ADMISSION_LATENCY_SLO_SECONDS", "2")),
+)
+
+# --- Prometheus Metrics ---
+UPLOAD_BYTES = Counter("gateway_upload_bytes_total", "Upload bytes streamed through to storage-service")
+UPLOADS_IN_PROGRESS = Gauge("gateway_uploads_in_progress", "Uploads currently being streamed")
+UPLOAD_SIZE = Histogram(
+    "gateway_upload_size_bytes",
+    "Size of completed uploads",
+    buckets=[1024 ** 2, 10 * 1024 ** 2, 100 * 1024 ** 2, 1024 ** 3, 5 * 1024 ** 3, 10 * 1024 ** 3],
+)
+UPLOAD_DURATION = Histogram(
+    "gateway_upload_duration_seconds",
+    "Time to stream an upload to storage-service",
+    buckets=[0.1, 0.5, 1, 5, 15, 60, 300, 900],
+)
+UPLOAD_REJECTED = Counter("gateway_upload_rejected_total", "Uploads rejected by the gateway", ["reason"])
+
+logger = setup_logger(__name__, service=OTEL_SERVICE_NAME)
 
 # --- OpenTelemetry Setup ---
 logger.info(f"Initializing OpenTelemetry for service: {OTEL_SERVICE_NAME}")
 logger.info(f"OTLP Exporter Endpoint: {OTEL_EXPORTER_OTLP_ENDPOINT}")
 
-# Set service name attribute
-resource = Resource(attributes={
-    SERVICE_NAME: OTEL_SERVICE_NAME
-})
-
-# Set up OTLP exporter
-otlp_exporter = OTLPSpanExporter(endpoint=OTEL_EXPORTER_OTLP_ENDPOINT)
-
-# Set up trace provider and processor
-trace_provider = TracerProvider(resource=resource)
-span_processor = BatchSpanProcessor(otlp_exporter)
-trace_provider.add_span_processor(span_processor)
-
-# Set the global tracer provider
-trace.set_tracer_provider(trace_provider)
+# Set up the sampled trace provider and set it as the global one
+trace_provider = setup_tracing(OTEL_SERVICE_NAME, OTEL_EXPORTER_OTLP_ENDPOINT)
 
 # Get a tracer
 tracer = trace.get_tracer(__name__)
 
-# Instrument FastAPI and Requests
+# Instrument FastAPI and httpx (adds trace context headers to upstream calls)
 app = FastAPI()
+app.add_middleware(CompressionMiddleware)
 FastAPIInstrumentor.instrument_app(app)
-RequestsInstrumentor().instrument() # Instrument the requests library
+HTTPXClientInstrumentor().instrument()
+
+# Pooled upstream clients, created once per worker; main-service is balanced across its replicas
+upstreams = {}
+main_service_pool = replica_pool_from_env("MAIN_SERVICE", MAIN_SERVICE)
+
+@app.on_event("startup")
+async def open_upstream_clients():
+    # loads the signing keys before the first request (no-op without AUTH_JWKS_URL)
+    await asyncio.to_thread(get_authenticator)
+    await main_service_pool.start()
+    upstreams["storage"] = create_client(STORAGE_SERVICE)
+
+@app.on_event("shutdown")
+async def close_upstream_clients():
+    await main_service_pool.close()
+    for client in upstreams.values():
+        await client.aclose()
+
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    return JSONResponse(
+        status_code=429,
+        content={"error": exc.reason},
+        headers={"Retry-After": exc.retry_after_header()},
+    )
 
+@app.exception_handler(InvalidToken)
+async def invalid_token_handler(request: Request, exc: InvalidToken):
+    return JSONResponse(status_code=401, content={"error": f"invalid token: {exc}"})
+
+def resolve_tenant(request: Request):
+    """
+    Same resolution as get_tenant_id_from_token in main-service and
+    storage-service, except that without authentication (every request is
+    the mock tenant) it returns None so no per-tenant rate limit applies.
+    """
+    if get_authenticator() is None:
+        return None
+    token = get_token_from_header(request.headers.get("authorization"))
+    return get_tenant_id_from_token(token)
+
+def passthrough_response(upstream_response, body):
+    headers = {"vary": "Accept-Encoding"}
+    if "content-encoding" in upstream_response.headers:
+        headers["content-encoding"] = upstream_response.headers["content-encoding"]
+    if "retry-after" in upstream_response.headers:
+        headers["retry-after"] = upstream_response.headers["retry-after"]
+    return Response(
+        content=body,
+        status_code=upstream_response.status_code,
+        media_type=upstream_response.headers.get("content-type", "application/json"),
+        headers=headers,
+    )
+
+def forwarded_headers(request: Request):
+    authorization = request.headers.get("authorization")
+    return {"authorization": authorization} if authorization else {}
 
 # --- API Endpoints ---
 @app.get("/")
@@ -60,6 +135,10 @@ def read_root():
     logger.info("GATEWAY-SERVICE: Received request for /")
     return {"service": OTEL_SERVICE_NAME, "status": "OK"}
 
+@app.get("/metrics")
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 class Result(BaseModel):
     product_id: str
     score: float
@@ -69,17 +148,23 @@ class QueryResponse(BaseModel):
     data: List[Result]
 
 @app.get("/query")
-async def query_endpoint(query: Optional[str] = Query(default=None)):
-    logger.info(f"GATEWAY-SERVICE: Received request for /query, calling {MAIN_SERVICE_URL}")
+async def query_endpoint(request: Request, query: Optional[str] = Query(default=None)):
+    logger.info("GATEWAY-SERVICE: Received request for /query")
     try:
-        # The RequestsInstrumentor automatically adds trace context headers
-        url = MAIN_SERVICE_URL + "/query?query=" + query
-        logger.info(f"GATEWAY-SERVICE: Calling main service: {url}")
-        response = requests.get(url)
-        response.raise_for_status() # Raise an exception for bad status codes
+        async with admission.admit(resolve_tenant(request)):
+            # The HTTPXClientInstrumentor automatically adds trace context headers
+            params = {"query": query} if query is not None else {}
+            # ask main-service for the client's encodings and relay the bytes as-is, no decode/re-encode here
+            headers = {**forwarded_headers(request), "accept-encoding": request.headers.get("accept-encoding", "identity")}
+            response = await main_service_pool.request("GET", "/query", params=params, headers=headers, stream=True)
+            try:
+                response.raise_for_status() # Raise an exception for bad status codes
+                body = b"".join([chunk async for chunk in response.aiter_raw()])
+            finally:
+                await response.aclose()
         logger.info(f"GATEWAY-SERVICE: Received response from main service: {response.status_code}")
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        return passthrough_response(response, body)
+    except httpx.HTTPError as e:
         logger.error(f"GATEWAY-SERVICE: Error calling Service B: {e}")
         # You might want to create a span manually here to record the error,
         # though the instrumentor might already capture the failed request.
@@ -88,27 +173,116 @@ async def query_endpoint(query: Optional[str] = Query(default=None)):
             span.record_exception(e)
         return {"error from main service": str(e)}
 
+class UploadTooLarge(Exception):
+    pass
+
+async def stream_request_body(request: Request, max_bytes: int):
+    """Yields the raw request body chunk by chunk as it arrives, enforcing the size cap on the way."""
+    total = 0
+    async for chunk in request.stream():
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadTooLarge(f"upload exceeds {max_bytes} bytes")
+        UPLOAD_BYTES.inc(len(chunk))
+        yield chunk
+    UPLOAD_SIZE.observe(total)
+
+def upload_too_large(reason):
+    UPLOAD_REJECTED.labels(reason=reason).inc()
+    return JSONResponse(status_code=413, content={"error": f"upload exceeds {MAX_UPLOAD_BYTES} bytes"})
+
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(request: Request):
+    """
+    Streams the multipart body to storage-service untouched (same content
+    type and boundary), without spooling it to disk or holding it in memory.
+    """
     logger.info(f"GATEWAY-SERVICE: Received request for /upload, calling {STORAGE_SERVICE_URL}")
+    admission.check_rate(resolve_tenant(request))
+    content_length = request.headers.get("content-length")
+    if content_length is not None and int(content_length) > MAX_UPLOAD_BYTES:
+        return upload_too_large("content_length")
+
+    headers = {"content-type": request.headers.get("content-type", "application/octet-stream"), **forwarded_headers(request)}
+    if content_length is not None:
+        headers["content-length"] = content_length
+
+    start_time = time.time()
+    UPLOADS_IN_PROGRESS.inc()
     try:
-        # The RequestsInstrumentor automatically adds trace context headers        
-        url = STORAGE_SERVICE_URL + "/upload"
-        logger.info(f"GATEWAY-SERVICE: Calling STORAGE_SERVICE_URL service: {url}")
-        files = {'file': file.file}
-        response = requests.post(url, files=files)
-        response.raise_for_status() # Raise an exception for bad status codes
-        logger.info(f"GATEWAY-SERVICE: Received response from main service: {response.status_code}")
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        logger.error(f"GATEWAY-SERVICE: Error calling Service B: {e}")
-        # You might want to create a span manually here to record the error,
-        # though the instrumentor might already capture the failed request.
+        # status and Retry-After are relayed, so clients see storage-service's 503 backpressure
+        return await relay_to_storage(
+            request, "POST", "/upload",
+            content=stream_request_body(request, MAX_UPLOAD_BYTES),
+            headers=headers,
+        )
+    except UploadTooLarge:
+        return upload_too_large("streamed_size")
+    finally:
+        UPLOADS_IN_PROGRESS.dec()
+        UPLOAD_DURATION.observe(time.time() - start_time)
+
+# --- Resumable uploads: relayed to storage-service, part bodies are streamed through ---
+async def relay_to_storage(request: Request, method: str, path: str, **kwargs):
+    try:
+        response = await upstreams["storage"].request(method, path, **kwargs)
+    except httpx.HTTPError as e:
+        logger.error(f"GATEWAY-SERVICE: Error calling storage service: {e}")
         with tracer.start_as_current_span("storage_service_error") as span:
             span.set_attribute("error", True)
             span.record_exception(e)
-        return {"error from main service": str(e)}
-    
+        return JSONResponse(status_code=502, content={"error from storage service": str(e)})
+    return passthrough_response(response, response.content)
+
+@app.post("/uploads")
+async def initiate_upload(request: Request):
+    admission.check_rate(resolve_tenant(request))
+    headers = {"content-type": "application/json", **forwarded_headers(request)}
+    return await relay_to_storage(request, "POST", "/uploads", content=await request.body(), headers=headers)
+
+@app.get("/uploads/{upload_id}")
+async def upload_status(upload_id: str, request: Request):
+    return await relay_to_storage(request, "GET", f"/uploads/{upload_id}", headers=forwarded_headers(request))
+
+@app.put("/uploads/{upload_id}/parts")
+async def upload_part(upload_id: str, request: Request, offset: int):
+    admission.check_rate(resolve_tenant(request))
+    content_length = request.headers.get("content-length")
+    if content_length is not None and int(content_length) > MAX_UPLOAD_BYTES:
+        return upload_too_large("content_length")
+
+    headers = {"content-type": "application/octet-stream", **forwarded_headers(request)}
+    if content_length is not None:
+        headers["content-length"] = content_length
+
+    start_time = time.time()
+    UPLOADS_IN_PROGRESS.inc()
+    try:
+        return await relay_to_storage(
+            request, "PUT", f"/uploads/{upload_id}/parts",
+            params={"offset": offset},
+            content=stream_request_body(request, MAX_UPLOAD_BYTES),
+            headers=headers,
+        )
+    except UploadTooLarge:
+        return upload_too_large("streamed_size")
+    finally:
+        UPLOADS_IN_PROGRESS.dec()
+        UPLOAD_DURATION.observe(time.time() - start_time)
+
+@app.post("/uploads/{upload_id}/commit")
+async def commit_upload(upload_id: str, request: Request):
+    return await relay_to_storage(request, "POST", f"/uploads/{upload_id}/commit", headers=forwarded_headers(request))
+
+@app.delete("/uploads/{upload_id}")
+async def abort_upload(upload_id: str, request: Request):
+    return await relay_to_storage(request, "DELETE", f"/uploads/{upload_id}", headers=forwarded_headers(request))
+
+# --- Ingest job progress, tracked by storage-service ---
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str, request: Request):
+    return await relay_to_storage(request, "GET", f"/jobs/{job_id}", headers=forwarded_headers(request))
+
     
 if __name__ == "__main__":
     import uvicorn
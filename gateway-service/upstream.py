@@ -0,0 +1,29 @@
+import os
+import httpx
+
+
+def upstream_config(prefix, default_url, default_timeout):
+    """
+    Reads one upstream's settings, e.g. for prefix MAIN_SERVICE:
+    MAIN_SERVICE_URL, MAIN_SERVICE_TIMEOUT, MAIN_SERVICE_CONNECT_TIMEOUT,
+    MAIN_SERVICE_MAX_CONNECTIONS, MAIN_SERVICE_MAX_KEEPALIVE.
+    """
+    return {
+        "url": os.getenv(f"{prefix}_URL", default_url),
+        "timeout": float(os.getenv(f"{prefix}_TIMEOUT", default_timeout)),
+        "connect_timeout": float(os.getenv(f"{prefix}_CONNECT_TIMEOUT", "2")),
+        "max_connections": int(os.getenv(f"{prefix}_MAX_CONNECTIONS", "100")),
+        "max_keepalive": int(os.getenv(f"{prefix}_MAX_KEEPALIVE", "20")),
+    }
+
+
+def create_client(config):
+    """A long-lived client with its own keep-alive pool, shared by every request to that upstream."""
+    return httpx.AsyncClient(
+        base_url=config["url"],
+        timeout=httpx.Timeout(config["timeout"], connect=config["connect_timeout"]),
+        limits=httpx.Limits(
+            max_connections=config["max_connections"],
+            max_keepalive_connections=config["max_keepalive"],
+        ),
+    )
@@ -5,18 +5,37 @@
 import csv
 import sys
 import json
-from publisher import publish_to_mq
+from publisher import publish_to_mq, ConfirmingPublisher
 import uuid
 from mq import create_connection_factory,create_channel,create_queue
 import requests
 import io
 import os
+import functools
+from concurrent.futures import ThreadPoolExecutor
 import uuid
+from common.profiler import install_signal_handlers
+from source import open_catalog, local_copy, resolve_local_path, TrackedLines
+from common.jobs import get_registry, PARSED
+from batcher import RowBatcher
+from common import codec
+from schema import build_projection, mapping_for, deletes_missing
+from formats import CSV, JSONL, PARQUET, UnsupportedFormat, csv_records, jsonl_records, parquet_records
+from ingest import publish_rows, envelope_fields, publish_end_of_sync
+from sharding import parse_in_parallel, should_parse_in_parallel
+from common.logging_conf import setup_logger
+
+logger = setup_logger("insertion-service", service="insertion-service")
 
 create_connection = create_connection_factory()
 
 csv.field_size_limit(sys.maxsize)
 
+# files ingested at once; each job runs on its own worker thread with its own producer connection
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "4"))
+# rows between resumable checkpoints; each one waits for the publisher's outstanding confirms
+CHECKPOINT_ROWS = int(os.getenv("CHECKPOINT_ROWS", "50000"))
+
 def download_csv(url: str, local_path: str) -> None:
     """
     Downloads the content at `url` and writes it as a binary file to `local_path`.
@@ -53,70 +72,180 @@ def download_and_process(url: str, local_path: str, channel, queue_name: str) ->
     download_csv(url, local_path)
     # process_local_csv(local_path, channel, queue_name)
 
-def process_csv_from_url(url, tenant_id, channel, queue_name):
-  
-    with requests.get(url, stream=True) as response:
-        response.raise_for_status()
-        if response.ok == False:
-            return
-        lines = response.iter_lines(decode_unicode=True)
-        reader = csv.DictReader(lines)
+def job_id_for(payload):
+    """Parse jobs queued before the registry existed get an id derived from the file, so redeliveries resume."""
+    return payload.get("job_id") or uuid.uuid5(uuid.NAMESPACE_URL, f"{payload['file_path']}#{payload.get('content_hash')}").hex
 
-        for row in reader:
-            data = {
-                "id": str(uuid.uuid4()),
-                "tenant_id": tenant_id,
-               **row
-            }
-            publish_to_mq(json.dumps(data), channel, queue_name)
-
-connection = create_connection()
-consumer_channel = create_channel(connection)
-consumer_queue = "parse_csv_queue"
-create_queue(consumer_channel,consumer_queue)
+def process_csv_from_url(payload, queue_name):
+    tenant_id = payload["tenant_id"]
+    job_id = job_id_for(payload)
+    registry = get_registry()
+    job = registry.start(job_id, tenant_id, os.path.basename(payload["file_path"]))
+    if job["status"] == PARSED:
+        # redelivered after it finished but before the ack went out
+        logger.info(f"job {job_id} was already parsed, skipping", extra={"tenant_id": tenant_id})
+        return
+
+    # messages queued before format detection are all CSV uploads
+    file_format = payload.get("format", CSV)
+    try:
+        # large CSV files on the shared volume are split into shards and parsed on every core
+        local_path = resolve_local_path(payload) if file_format == CSV else None
+        parallel = should_parse_in_parallel(local_path)
+        if parallel:
+            rows = parse_in_parallel(local_path, tenant_id, queue_name, job)
+            logger.info(f"published {rows} rows from parallel shards", extra={"tenant_id": tenant_id, "job_id": job_id})
+        elif file_format == PARQUET:
+            rows = parse_parquet(payload, tenant_id, queue_name, job, registry)
+        elif file_format in (CSV, JSONL):
+            rows = parse_serially(payload, tenant_id, queue_name, job, registry, file_format)
+        else:
+            raise UnsupportedFormat(f"unknown file format {file_format}")
+
+        if deletes_missing(tenant_id):
+            with ConfirmingPublisher(queue_name) as publisher:
+                publish_end_of_sync(publisher, job_id, tenant_id)
+        # parallel shards already added their row counts as they finished
+        registry.finish(job_id, rows=None if parallel else rows)
+    except Exception as e:
+        registry.finish(job_id, error=e)
+        raise
 
+def parse_serially(payload, tenant_id, queue_name, job, registry, file_format=CSV):
+    """
+    Parses a CSV or JSON Lines file in one pass, checkpointing every
+    CHECKPOINT_ROWS rows: once the rows so far are confirmed by the broker,
+    the byte offset of the next record is saved, and a crashed job picks
+    up from there.
+    """
+    job_id = job["job_id"]
+    # a CSV job resumes only once its header is known; JSON Lines records carry their own keys
+    resume = bool(job["checkpoint_offset"] and (file_format != CSV or job["header"]))
+    offset = job["checkpoint_offset"] if resume else 0
+    header = job["header"] if resume else None
+    if resume:
+        logger.info(f"resuming job {job_id} at byte {offset}, row {job['rows_published']}", extra={"tenant_id": tenant_id})
+
+    # its own connection, pipelined with confirms; leaving the block waits for the last confirm
+    with ConfirmingPublisher(queue_name) as publisher, open_catalog(payload, offset) as raw_lines:
+        lines = TrackedLines(raw_lines, offset)
+        batcher = RowBatcher(publisher.publish, fields=envelope_fields(job_id, tenant_id))
+        if file_format == JSONL:
+            records = jsonl_records(lines, mapping_for(tenant_id))
+        else:
+            reader = csv.reader(lines)
+            if header is None:
+                header = next(reader, None)
+                if header is None:
+                    return 0
+                registry.set_header(job_id, header)
+            # only the tenant's mapped columns, renamed and truncated, go into the queue
+            records = csv_records(reader, build_projection(header, tenant_id))
+
+        def checkpoint(count):
+            batcher.flush()
+            publisher.flush()
+            registry.checkpoint(job_id, lines.offset, count)
+
+        rows = publish_rows(
+            records, tenant_id, batcher,
+            count=job["rows_published"] if resume else 0,
+            checkpoint_every=CHECKPOINT_ROWS,
+            on_checkpoint=checkpoint,
+        )
+
+    logger.info(
+        f"published {batcher.rows_published} rows in {batcher.batches_published} batches"
+        f" ({publisher.republished} republished)",
+        extra={"tenant_id": tenant_id, "job_id": job_id},
+    )
+    return rows
+
+def parse_parquet(payload, tenant_id, queue_name, job, registry):
+    """
+    Streams a Parquet file's record batches into the queue. Parquet has no
+    byte offset to resume from, so its checkpoint offset is the row count:
+    a resumed job skips that many rows.
+    """
+    job_id = job["job_id"]
+    skip_rows = job["checkpoint_offset"] or 0
+    if skip_rows:
+        logger.info(f"resuming job {job_id} at row {skip_rows}", extra={"tenant_id": tenant_id})
+
+    with ConfirmingPublisher(queue_name) as publisher, local_copy(payload) as path:
+        batcher = RowBatcher(publisher.publish, fields=envelope_fields(job_id, tenant_id))
+
+        def checkpoint(count):
+            batcher.flush()
+            publisher.flush()
+            registry.checkpoint(job_id, count, count)
+
+        rows = publish_rows(
+            parquet_records(path, mapping_for(tenant_id), skip_rows=skip_rows), tenant_id, batcher,
+            count=skip_rows,
+            checkpoint_every=CHECKPOINT_ROWS,
+            on_checkpoint=checkpoint,
+        )
+
+    logger.info(
+        f"published {batcher.rows_published} Parquet rows in {batcher.batches_published} batches",
+        extra={"tenant_id": tenant_id, "job_id": job_id},
+    )
+    return rows
 
 def handler(event, context):
     payload = event["payload"]
     file_path = payload["file_path"]
-    tenant_id = payload["tenant_id"]
-    create_connection = create_connection_factory()
-    producer_connection = create_connection()
-    producer_channel = create_channel(connection)
     producer_queue = "product_sync"
-    create_queue(producer_channel,producer_queue)
-
-
 
     try:
-        process_csv_from_url(file_path, tenant_id, producer_channel, producer_queue)
-    except Exception as e:
-        print(e)
-    
-    producer_connection.close()
-    return
-
-
+        process_csv_from_url(payload, producer_queue)
+    except Exception:
+        logger.exception(f"failed to process {file_path}")
 
+    return
 
 
+def run_job(event, delivery_tag):
+    """
+    Runs on an executor thread. The ack is handed back to the connection's
+    own thread, since pika channels must only be used from there.
+    """
+    try:
+        handler(event, None)
+    finally:
+        connection.add_callback_threadsafe(functools.partial(consumer_channel.basic_ack, delivery_tag=delivery_tag))
 
 
-print("consumer channel closed",consumer_channel.is_closed)
+def callback(ch, method, properties, body):
+    try:
+        dict_body = codec.decode(body, properties.content_type, properties.content_encoding)
+    except Exception:
+        logger.exception("dropping undecodable parse job")
+        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        return
+    logger.info("Received message", extra={"body": dict_body})
 
+    # the consumer thread only dispatches, so heartbeats keep flowing during long files
+    executor.submit(run_job, dict_body, method.delivery_tag)
 
-def callback(ch, method, properties, body):
-    dict_body = json.loads(body.decode())
-    print("Received message:", dict_body)
 
-    handler(json.loads(body), None)
-    consumer_channel.basic_ack(delivery_tag=method.delivery_tag)
+# only when run as the service: spawned shard workers (sharding.py) import this module too
+if __name__ == "__main__":
+    connection = create_connection()
+    consumer_channel = create_channel(connection)
+    consumer_queue = "parse_csv_queue"
+    create_queue(consumer_channel,consumer_queue)
 
+    executor = ThreadPoolExecutor(max_workers=INGEST_CONCURRENCY, thread_name_prefix="ingest")
 
-consumer_channel.basic_consume(queue=consumer_queue, on_message_callback=callback)
+    install_signal_handlers()
+    # at most one unacked parse job per worker: the rest stay in the queue for other replicas
+    consumer_channel.basic_qos(prefetch_count=INGEST_CONCURRENCY)
+    consumer_channel.basic_consume(queue=consumer_queue, on_message_callback=callback)
 
-print('[*] Waiting for up to 3 messages at a time. To exit press CTRL+C')
-consumer_channel.start_consuming()
+    logger.info('[*] Waiting for messages. To exit press CTRL+C')
+    consumer_channel.start_consuming()
 
 
 
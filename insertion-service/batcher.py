@@ -0,0 +1,51 @@
+import logging
+import os
+
+from common import codec
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_ROWS = int(os.getenv("BATCH_MAX_ROWS", "500"))
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", str(1024 * 1024)))
+
+
+class RowBatcher:
+    """
+    Collects rows into batch envelopes, {"version": 1, "rows": [...]}, and
+    hands each one to `publish(body, properties)` once it holds `max_rows`
+    rows or would grow past `max_bytes` (measured before compression). A
+    single row larger than `max_bytes` still goes out, alone in its
+    envelope. Call flush() after the last row.
+    """
+
+    def __init__(self, publish, max_rows=BATCH_MAX_ROWS, max_bytes=BATCH_MAX_BYTES, content_type=None, fields=None):
+        self.publish = publish
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.content_type = content_type or codec.producer_content_type()
+        # envelope-level fields such as the job_id, sent once per batch rather than per row
+        self.fields = fields
+        self.overhead = len(codec.encode_envelope([], self.content_type, fields)) + 5
+        self.rows = []
+        self.size = self.overhead
+        self.rows_published = 0
+        self.batches_published = 0
+
+    def add(self, row):
+        encoded = codec.encode_row(row, self.content_type)
+        if self.rows and self.size + len(encoded) + 1 > self.max_bytes:
+            self.flush()
+        self.rows.append(encoded)
+        self.size += len(encoded) + 1
+        if len(self.rows) >= self.max_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        body, properties = codec.seal(codec.encode_envelope(self.rows, self.content_type, self.fields), self.content_type)
+        self.publish(body, properties)
+        self.rows_published += len(self.rows)
+        self.batches_published += 1
+        self.rows = []
+        self.size = self.overhead
@@ -0,0 +1,97 @@
+import json
+import logging
+import os
+
+from schema import DictProjection, KEY_COLUMN, normalize_column
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+CSV = "csv"
+JSONL = "jsonl"
+PARQUET = "parquet"
+
+PARQUET_BATCH_ROWS = int(os.getenv("PARQUET_BATCH_ROWS", "10000"))
+
+
+class UnsupportedFormat(Exception):
+    pass
+
+
+def csv_records(reader, project):
+    """(fields, key) for each non-empty csv.reader row."""
+    for values in reader:
+        if values:
+            yield project(values), project.key(values)
+
+
+def jsonl_records(lines, mapping):
+    """
+    (fields, key) for each JSON object line. Records need not share their
+    keys, so each one's keys are normalized and matched against every
+    mapped column; a column a record lacks is left empty.
+    """
+    columns = [normalize_column((spec or {}).get("source", name)) for name, spec in mapping["fields"].items()]
+    columns.append(normalize_column(mapping.get("key_column", KEY_COLUMN)))
+    project = DictProjection(columns, mapping)
+    for line in lines:
+        if not line.strip():
+            continue
+        record = {normalize_column(key): value for key, value in json.loads(line).items()}
+        yield project(record), project.key(record)
+
+
+def _text_column(column, max_length=None):
+    try:
+        column = pyarrow.compute.cast(column, pyarrow.string())
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowNotImplementedError):
+        # nested types have no string cast: serialize them as JSON
+        column = pyarrow.array(
+            [None if value is None else json.dumps(value, default=str) for value in column.to_pylist()],
+            type=pyarrow.string(),
+        )
+    column = pyarrow.compute.fill_null(column, "")
+    if max_length:
+        column = pyarrow.compute.utf8_slice_codeunits(column, 0, max_length)
+    return column
+
+
+def parquet_records(path, mapping, skip_rows=0, batch_size=PARQUET_BATCH_ROWS):
+    """
+    (fields, key) for each row of a Parquet file, read in record batches
+    with only the mapped columns decoded. Casting, null filling and
+    truncation run on whole Arrow columns, and each batch becomes Python
+    dicts in one to_pylist call instead of row by row. The first
+    `skip_rows` rows are skipped, for resumed jobs.
+    """
+    if pyarrow is None:
+        raise UnsupportedFormat("Parquet ingest needs pyarrow, which is not installed")
+
+    parquet_file = pyarrow.parquet.ParquetFile(path)
+    project = DictProjection(parquet_file.schema_arrow.names, mapping)
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=project.source_columns()):
+        if skip_rows >= batch.num_rows:
+            skip_rows -= batch.num_rows
+            continue
+        if skip_rows:
+            batch = batch.slice(skip_rows)
+            skip_rows = 0
+
+        if project.columns:
+            fields = pyarrow.RecordBatch.from_arrays(
+                [_text_column(batch.column(source), max_length) for _, source, max_length in project.columns],
+                names=[name for name, _, _ in project.columns],
+            ).to_pylist()
+        else:
+            fields = [{} for _ in range(batch.num_rows)]
+        if project.key_column is not None:
+            keys = [key.strip() or None for key in _text_column(batch.column(project.key_column)).to_pylist()]
+        else:
+            keys = [None] * batch.num_rows
+        yield from zip(fields, keys)
@@ -0,0 +1,68 @@
+import hashlib
+import json
+import uuid
+
+from common import codec
+from schema import deletes_missing
+
+PRODUCT_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "product-catalog")
+
+
+def row_hash(fields):
+    """Fingerprint of the fields sent downstream; unchanged rows are skipped before embedding."""
+    return hashlib.blake2b(json.dumps(fields, sort_keys=True, separators=(",", ":")).encode(), digest_size=16).hexdigest()
+
+
+def product_id(tenant_id, key):
+    """Stable across uploads, so a re-synced product updates its existing point in place."""
+    return str(uuid.uuid5(PRODUCT_ID_NAMESPACE, f"{tenant_id}:{key}"))
+
+
+def envelope_fields(job_id, tenant_id):
+    """A full sync tags every row with its run, so products the run did not touch can be deleted."""
+    if deletes_missing(tenant_id):
+        return {"job_id": job_id, "sync_run_id": job_id}
+    return {"job_id": job_id}
+
+
+def publish_end_of_sync(publisher, job_id, tenant_id):
+    """
+    Sent after a full sync's last row. sync-consumer-service deletes the
+    tenant's products from earlier runs once every row of this job is synced.
+    """
+    body, properties = codec.encode({
+        "version": codec.ENVELOPE_VERSION,
+        "control": "end_of_sync",
+        "job_id": job_id,
+        "tenant_id": tenant_id,
+        "sync_run_id": job_id,
+        "rows": [],
+    })
+    publisher.publish(body, properties)
+
+
+def publish_rows(records, tenant_id, batcher, count=0, checkpoint_every=None, on_checkpoint=None):
+    """
+    Feeds projected (fields, key) records, from any input format, to the
+    batcher; returns the running row count, starting from `count`. Every
+    `checkpoint_every` rows `on_checkpoint(count)` is called, after the
+    row was added.
+
+    Rows without a key column value are identified by their content, so
+    an edit to such a row shows up as a new product.
+    """
+    for fields, key in records:
+        content_hash = row_hash(fields)
+        # computed keys last: they must win over any mapped field of the same name
+        data = {
+            **fields,
+            "id": product_id(tenant_id, key or f"content:{content_hash}"),
+            "tenant_id": tenant_id,
+            "content_hash": content_hash,
+        }
+        batcher.add(data)
+        count += 1
+        if checkpoint_every and count % checkpoint_every == 0:
+            on_checkpoint(count)
+    batcher.flush()
+    return count
@@ -1,5 +1,10 @@
 import pika
 
+
+def connection_parameters():
+    return pika.ConnectionParameters('rabbitmq')
+
+
 def create_connection_factory():
     connection = None
 
@@ -8,7 +13,7 @@ def create_connection_factory():
         if connection is not None:
             return connection
 
-        connection = pika.BlockingConnection(pika.ConnectionParameters('rabbitmq'))
+        connection = pika.BlockingConnection(connection_parameters())
         return connection
     
     return create_connection
@@ -1,18 +1,319 @@
+import collections
+import logging
+import os
+import threading
+import time
+
 import pika
+import pika.exceptions
+
+from mq import connection_parameters
+
+logger = logging.getLogger(__name__)
+
+PUBLISH_WINDOW = int(os.getenv("PUBLISH_WINDOW", "64"))
+PUBLISH_MAX_RETRIES = int(os.getenv("PUBLISH_MAX_RETRIES", "5"))
+PUBLISH_FLUSH_TIMEOUT = float(os.getenv("PUBLISH_FLUSH_TIMEOUT", "600"))
+# pause publishing while product_sync holds more than this many messages (0 disables)
+PRODUCT_SYNC_MAX_DEPTH = int(os.getenv("PRODUCT_SYNC_MAX_DEPTH", "2000"))
+PRODUCT_SYNC_RESUME_DEPTH = int(os.getenv("PRODUCT_SYNC_RESUME_DEPTH", str(PRODUCT_SYNC_MAX_DEPTH // 2)))
+QUEUE_DEPTH_CHECK_INTERVAL = float(os.getenv("QUEUE_DEPTH_CHECK_INTERVAL", "1"))
+# publish() gives up once it has been blocked this long with no connection to RabbitMQ
+PUBLISH_RECONNECT_TIMEOUT = float(os.getenv("PUBLISH_RECONNECT_TIMEOUT", "120"))
+
 
-def publish_to_mq(message, channel, queue_name):
-    ""
-    print("queue name",queue_name)
+def publish_to_mq(message, channel, queue_name, properties=None):
+    """`properties` carries the codec's content_type/content_encoding."""
     channel.basic_publish(
         exchange='',
         routing_key=queue_name,
         body=message,
         properties=pika.BasicProperties(
             delivery_mode=2,  # Make message persistent
+            **(properties or {})
         )
     )
 
-    print(f"[x] Sent: {message}")
+    # one record per batch of CSV rows: keep it at DEBUG and sampled so it never throttles ingestion
+    logger.debug("[x] Sent batch", extra={"queue": queue_name, "sample_rate": 0.01})
+
+
+class PublishFailed(Exception):
+    pass
+
+
+class ConfirmingPublisher:
+    """
+    Pipelined publisher with publisher confirms, for one ingest job.
+
+    It runs a pika SelectConnection on its own I/O thread. publish() only
+    queues the message and wakes that thread, which writes everything
+    queued since its last pass in one go, so publishing never waits for a
+    broker round trip. At most `window` messages may be unconfirmed; the
+    window blocks publish() beyond that.
+
+    Nacked messages are republished, up to `max_retries` times. After a
+    dropped connection the publisher reconnects with backoff and
+    republishes every unconfirmed message. Messages are only forgotten
+    once the broker has acked them, and flush() raises PublishFailed if
+    any message could not be delivered.
+
+    While `queue_name` holds more than `max_queue_depth` messages,
+    publish() pauses until the depth falls back to `resume_queue_depth`.
+    This keeps the job's pace to what the consumers can absorb. A publish()
+    blocked on the window or a pause raises PublishFailed once the
+    connection has been down for `reconnect_timeout` seconds.
+    """
+
+    def __init__(self, queue_name, window=PUBLISH_WINDOW, max_retries=PUBLISH_MAX_RETRIES,
+                 max_queue_depth=PRODUCT_SYNC_MAX_DEPTH, resume_queue_depth=PRODUCT_SYNC_RESUME_DEPTH,
+                 depth_check_interval=QUEUE_DEPTH_CHECK_INTERVAL, max_backoff=30.0,
+                 reconnect_timeout=PUBLISH_RECONNECT_TIMEOUT):
+        self.queue_name = queue_name
+        self.max_retries = max_retries
+        self.max_queue_depth = max_queue_depth
+        self.resume_queue_depth = resume_queue_depth
+        self.depth_check_interval = depth_check_interval
+        self.max_backoff = max_backoff
+        self.reconnect_timeout = reconnect_timeout
+
+        self._window = threading.Semaphore(window)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = collections.deque()
+        self._outstanding = {}
+        self._in_flight = 0
+        self._delivery_tag = 0
+        self._drain_scheduled = False
+        self._error = None
+        self._closing = False
+        self._ready = threading.Event()
+        self._down_since = None
+        self._not_paused = threading.Event()
+        self._not_paused.set()
+
+        self._connection = None
+        self._channel = None
+        self._thread = None
+
+        self.published = 0
+        self.confirmed = 0
+        self.republished = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            self.close()
+
+    def start(self, timeout=30.0):
+        self._thread = threading.Thread(target=self._run, name=f"publisher-{self.queue_name}", daemon=True)
+        self._thread.start()
+        if not self._ready.wait(timeout):
+            self.close()
+            raise PublishFailed(f"could not open a confirming channel for {self.queue_name}")
+
+    def publish(self, body, properties=None):
+        if self._error is not None:
+            raise self._error
+        self._wait(self._not_paused.wait, "the queue to drain")
+        self._wait(lambda timeout: self._window.acquire(timeout=timeout), "a confirm window slot")
+        with self._lock:
+            self._pending.append((body, properties or {}, 0))
+            self._in_flight += 1
+        self._schedule_drain()
+
+    def _wait(self, acquire, what):
+        """Calls `acquire(timeout)` in short slices until it succeeds, the publisher fails, or the connection stays down."""
+        while not acquire(1.0):
+            if self._error is not None:
+                raise self._error
+            if self._closing:
+                raise PublishFailed(f"publisher for {self.queue_name} is closed")
+            down_since = self._down_since
+            if down_since is not None and time.monotonic() - down_since > self.reconnect_timeout:
+                raise PublishFailed(f"no connection to RabbitMQ for {self.reconnect_timeout}s while waiting for {what}")
+
+    def flush(self, timeout=PUBLISH_FLUSH_TIMEOUT):
+        """Blocks until every published message is confirmed."""
+        with self._idle:
+            done = self._idle.wait_for(lambda: self._in_flight == 0 or self._error is not None, timeout)
+        if self._error is not None:
+            raise self._error
+        if not done:
+            raise PublishFailed(f"{self._in_flight} messages still unconfirmed after {timeout}s")
+
+    def close(self):
+        self._closing = True
+        self._not_paused.set()
+        connection = self._connection
+        if connection is not None:
+            try:
+                connection.ioloop.add_callback_threadsafe(self._close_connection)
+            except Exception:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+
+    # --- everything below runs on the I/O thread ---
+
+    def _run(self):
+        backoff = 0.5
+        while not self._closing:
+            self._connection = pika.SelectConnection(
+                connection_parameters(),
+                on_open_callback=self._on_connection_open,
+                on_open_error_callback=self._on_connection_open_error,
+                on_close_callback=self._on_connection_closed,
+            )
+            try:
+                self._connection.ioloop.start()
+            except Exception:
+                logger.exception("publisher I/O loop failed")
+            if self._closing:
+                break
+            if self._down_since is None:
+                self._down_since = time.monotonic()
+            if self._ready.is_set():
+                backoff = 0.5
+            self._ready.clear()
+            logger.warning(f"publisher connection lost, reconnecting in {backoff:.1f}s")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def _close_connection(self):
+        if self._connection.is_open:
+            self._connection.close()
+
+    def _on_connection_open(self, connection):
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_connection_open_error(self, connection, error):
+        logger.warning(f"publisher could not connect: {error}")
+        connection.ioloop.stop()
+
+    def _on_connection_closed(self, connection, reason):
+        self._channel = None
+        with self._lock:
+            # unconfirmed messages may or may not have reached the queue: republish them
+            self._pending.extendleft(reversed(list(self._outstanding.values())))
+            self.republished += len(self._outstanding)
+            self._outstanding.clear()
+            self._drain_scheduled = False
+        connection.ioloop.stop()
+
+    def _on_channel_open(self, channel):
+        with self._lock:
+            # delivery tags restart at 1 on every channel; anything still unconfirmed goes out again
+            self._pending.extendleft(reversed(list(self._outstanding.values())))
+            self.republished += len(self._outstanding)
+            self._outstanding.clear()
+            self._delivery_tag = 0
+        self._channel = channel
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.confirm_delivery(self._on_delivery_confirmation)
+        channel.queue_declare(queue=self.queue_name, durable=True, callback=self._on_queue_declared)
+
+    def _on_channel_closed(self, channel, reason):
+        logger.warning(f"publisher channel closed: {reason}")
+        self._close_connection()
+
+    def _on_queue_declared(self, method_frame):
+        self._down_since = None
+        self._ready.set()
+        if self.max_queue_depth > 0:
+            self._check_queue_depth()
+        self._drain()
+
+    def _schedule_drain(self):
+        with self._lock:
+            if self._drain_scheduled:
+                return
+            self._drain_scheduled = True
+        try:
+            self._connection.ioloop.add_callback_threadsafe(self._drain)
+        except Exception:
+            # between connections; the next _on_queue_declared drains the backlog
+            pass
+
+    def _drain(self):
+        with self._lock:
+            self._drain_scheduled = False
+            batch = list(self._pending)
+            self._pending.clear()
+        # not before the queue is declared: publishing starts the channel's delivery tags
+        if not self._ready.is_set() or self._channel is None or not self._channel.is_open:
+            with self._lock:
+                self._pending.extendleft(reversed(batch))
+            return
+
+        for index, (body, properties, attempts) in enumerate(batch):
+            try:
+                self._channel.basic_publish(
+                    exchange='',
+                    routing_key=self.queue_name,
+                    body=body,
+                    properties=pika.BasicProperties(delivery_mode=2, **properties),
+                )
+            except pika.exceptions.AMQPError:
+                with self._lock:
+                    self._pending.extendleft(reversed(batch[index:]))
+                self._close_connection()
+                return
+            self._delivery_tag += 1
+            self._outstanding[self._delivery_tag] = (body, properties, attempts)
+        self.published += len(batch)
+        logger.debug("[x] Sent batches", extra={"queue": self.queue_name, "count": len(batch), "sample_rate": 0.01})
+
+    def _on_delivery_confirmation(self, method_frame):
+        method = method_frame.method
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        if method.multiple:
+            tags = [tag for tag in list(self._outstanding) if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag]
+
+        retry = False
+        with self._lock:
+            for tag in tags:
+                entry = self._outstanding.pop(tag, None)
+                if entry is None:
+                    continue
+                body, properties, attempts = entry
+                if not acked and attempts < self.max_retries:
+                    # keeps its window slot until it is finally confirmed
+                    self._pending.append((body, properties, attempts + 1))
+                    self.republished += 1
+                    retry = True
+                    continue
+                if acked:
+                    self.confirmed += 1
+                else:
+                    self._error = PublishFailed(f"message nacked {attempts + 1} times by {self.queue_name}")
+                    logger.error(str(self._error))
+                self._in_flight -= 1
+                self._window.release()
+            if self._in_flight == 0 or self._error is not None:
+                self._idle.notify_all()
+        if retry:
+            self._drain()
+
+    def _check_queue_depth(self):
+        if self._channel is None or not self._channel.is_open:
+            return
+        self._channel.queue_declare(queue=self.queue_name, passive=True, callback=self._on_queue_depth)
+        self._connection.ioloop.call_later(self.depth_check_interval, self._check_queue_depth)
 
-    # Close connection
-    
+    def _on_queue_depth(self, method_frame):
+        depth = method_frame.method.message_count
+        if depth > self.max_queue_depth and self._not_paused.is_set():
+            logger.info(f"{self.queue_name} holds {depth} messages, pausing publishing")
+            self._not_paused.clear()
+        elif depth <= self.resume_queue_depth and not self._not_paused.is_set():
+            logger.info(f"{self.queue_name} drained to {depth} messages, resuming publishing")
+            self._not_paused.set()
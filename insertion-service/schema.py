@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# {"default": {...}, "<tenant_id>": {...}}, each mapping being
+# {"fields": {"<output name>": {"source": "<csv column>", "max_length": 2000}},
+#  "key_column": "sku", "delete_missing": false};
+# "source" defaults to the output name, "max_length" to no truncation
+SCHEMA_MAPPINGS_FILE = os.getenv("SCHEMA_MAPPINGS_FILE")
+MAX_FIELD_LENGTH = int(os.getenv("MAX_FIELD_LENGTH", "4000"))
+# the column that identifies a product across uploads
+KEY_COLUMN = os.getenv("KEY_COLUMN", "id")
+# treat every upload as the tenant's full catalog and delete products missing from it
+DELETE_MISSING_ROWS = os.getenv("DELETE_MISSING_ROWS", "false").lower() == "true"
+
+# set by insertion-service on every row; a mapped output field must not shadow them
+RESERVED_FIELDS = ("id", "tenant_id", "content_hash")
+
+# the columns sync-consumer-service's preprocessor turns into the embedded text
+DEFAULT_MAPPING = {
+    "fields": {
+        "title": {"max_length": 1000},
+        "description": {"max_length": MAX_FIELD_LENGTH},
+        "price": {"max_length": 64},
+        "category": {"max_length": 1000},
+        "brand": {"max_length": 1000},
+    }
+}
+
+
+class InvalidMapping(ValueError):
+    pass
+
+
+def validate_mapping(name, mapping):
+    reserved = [field for field in mapping.get("fields", {}) if field in RESERVED_FIELDS]
+    if reserved:
+        raise InvalidMapping(f"mapping {name!r} uses reserved output field names: {', '.join(reserved)}")
+
+
+@lru_cache(maxsize=1)
+def load_mappings():
+    if not SCHEMA_MAPPINGS_FILE:
+        return {}
+    with open(SCHEMA_MAPPINGS_FILE) as f:
+        mappings = json.load(f)
+    for name, mapping in mappings.items():
+        validate_mapping(name, mapping)
+    return mappings
+
+
+def mapping_for(tenant_id):
+    mappings = load_mappings()
+    return mappings.get(tenant_id) or mappings.get("default") or DEFAULT_MAPPING
+
+
+def deletes_missing(tenant_id):
+    return mapping_for(tenant_id).get("delete_missing", DELETE_MISSING_ROWS)
+
+
+def normalize_column(name):
+    return name.strip().lstrip("\ufeff").strip().lower()
+
+
+class Projection:
+    """
+    Turns raw csv.reader rows into dicts holding only the mapped columns,
+    renamed and truncated, so unused (and often huge) columns are dropped
+    before anything is built for them. Source columns are matched
+    case-insensitively; ones missing from the header are left out.
+    key() returns the row's key column value, which need not be mapped.
+    """
+
+    def __init__(self, header, mapping):
+        positions = {}
+        for index, column in enumerate(header):
+            positions.setdefault(normalize_column(column), index)
+
+        self.columns = []
+        for name, spec in mapping["fields"].items():
+            source = (spec or {}).get("source", name)
+            index = positions.get(normalize_column(source))
+            if index is None:
+                logger.warning(f"column {source!r} not found in the CSV header, {name!r} will be left out")
+                continue
+            self.columns.append((name, index, (spec or {}).get("max_length")))
+
+        key_column = mapping.get("key_column", KEY_COLUMN)
+        self.key_index = positions.get(normalize_column(key_column))
+        if self.key_index is None:
+            logger.warning(f"key column {key_column!r} not found in the CSV header, product ids will be derived from row content")
+
+    def __call__(self, values):
+        row = {}
+        for name, index, max_length in self.columns:
+            value = values[index] if index < len(values) else ""
+            row[name] = value[:max_length] if max_length else value
+        return row
+
+    def key(self, values):
+        if self.key_index is None or self.key_index >= len(values):
+            return None
+        return values[self.key_index].strip() or None
+
+
+class DictProjection:
+    """
+    The Projection counterpart for formats whose records are already keyed
+    by column name (JSON Lines, Parquet). `columns` are the names present
+    in the file; mapped sources are matched against them case-insensitively.
+    """
+
+    def __init__(self, columns, mapping):
+        names = {}
+        for column in columns:
+            names.setdefault(normalize_column(column), column)
+
+        self.columns = []
+        for name, spec in mapping["fields"].items():
+            source = names.get(normalize_column((spec or {}).get("source", name)))
+            if source is None:
+                logger.warning(f"column {name!r} not found in the file, it will be left out")
+                continue
+            self.columns.append((name, source, (spec or {}).get("max_length")))
+
+        self.key_column = names.get(normalize_column(mapping.get("key_column", KEY_COLUMN)))
+        if self.key_column is None:
+            logger.warning("key column not found in the file, product ids will be derived from row content")
+
+    def source_columns(self):
+        sources = [source for _, source, _ in self.columns]
+        if self.key_column is not None:
+            sources.append(self.key_column)
+        return list(dict.fromkeys(sources))
+
+    def __call__(self, record):
+        row = {}
+        for name, source, max_length in self.columns:
+            value = as_text(record.get(source))
+            row[name] = value[:max_length] if max_length else value
+        return row
+
+    def key(self, record):
+        if self.key_column is None:
+            return None
+        return as_text(record.get(self.key_column)).strip() or None
+
+
+def as_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+
+def build_projection(header, tenant_id):
+    return Projection(header, mapping_for(tenant_id))
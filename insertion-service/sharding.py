@@ -0,0 +1,169 @@
+import csv
+import io
+import logging
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from batcher import RowBatcher
+from ingest import publish_rows, envelope_fields
+from formats import csv_records
+from publisher import ConfirmingPublisher
+from schema import build_projection
+from common.jobs import get_registry
+from common.logging_conf import setup_logger
+
+logger = logging.getLogger(__name__)
+
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(os.cpu_count() or 1)))
+PARALLEL_PARSE_MIN_BYTES = int(os.getenv("PARALLEL_PARSE_MIN_BYTES", str(256 * 1024 * 1024)))
+SCAN_CHUNK_SIZE = 1024 * 1024
+QUOTE = b'"'
+NEWLINE = b"\n"
+
+
+def next_record_start(f, position, in_quotes):
+    """
+    Offset just past the first newline at or after `position` that is not
+    inside a quoted field, given whether `position` itself is inside one.
+    Quote parity is enough for RFC 4180 CSV: an escaped quote ("") flips
+    it twice. Returns the file size if there is no such newline.
+    """
+    f.seek(position)
+    while True:
+        chunk = f.read(SCAN_CHUNK_SIZE)
+        if not chunk:
+            return position
+        start = 0
+        while True:
+            newline = chunk.find(NEWLINE, start)
+            if newline == -1:
+                in_quotes ^= bool(chunk.count(QUOTE, start) & 1)
+                break
+            in_quotes ^= bool(chunk.count(QUOTE, start, newline) & 1)
+            if not in_quotes:
+                return position + newline + 1
+            start = newline + 1
+        position += len(chunk)
+
+
+def shard_ranges(path, shards):
+    """
+    Splits a CSV file into up to `shards` byte ranges that each start and
+    end on a record boundary. Returns (header_end, ranges). Quote parity
+    is carried forward with one fast bytes.count pass, so split points
+    never fall inside a quoted field, even one that spans several lines.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        header_end = next_record_start(f, 0, False)
+        boundaries = [header_end]
+        position, in_quotes = header_end, False
+        for shard in range(1, shards):
+            target = header_end + (size - header_end) * shard // shards
+            if target <= boundaries[-1]:
+                continue
+            f.seek(position)
+            while position < target:
+                chunk = f.read(min(SCAN_CHUNK_SIZE, target - position))
+                in_quotes ^= bool(chunk.count(QUOTE) & 1)
+                position += len(chunk)
+            boundary = next_record_start(f, position, in_quotes)
+            if boundary >= size:
+                break
+            boundaries.append(boundary)
+            position, in_quotes = boundary, False
+        boundaries.append(size)
+    return header_end, list(zip(boundaries, boundaries[1:]))
+
+
+class RangeReader(io.RawIOBase):
+    """Raw file reader confined to the byte range [start, end)."""
+
+    def __init__(self, path, start, end):
+        self._file = open(path, "rb", buffering=0)
+        self._file.seek(start)
+        self._remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._remaining <= 0:
+            return 0
+        view = memoryview(buffer)[:self._remaining]
+        read = self._file.readinto(view)
+        self._remaining -= read
+        return read
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def open_range(path, start, end, buffer_size=SCAN_CHUNK_SIZE):
+    raw = io.BufferedReader(RangeReader(path, start, end), buffer_size=buffer_size)
+    return io.TextIOWrapper(raw, encoding="utf-8", newline="")
+
+
+def read_header(path, header_end):
+    with open_range(path, 0, header_end) as f:
+        return next(csv.reader(f), None)
+
+
+def parse_shard(path, start, end, header, tenant_id, queue_name, job_id):
+    """
+    Runs in a worker process: parses one byte range and publishes its rows
+    in batches through the worker's own confirming publisher. Returns the
+    row count once every batch is confirmed.
+    """
+    csv.field_size_limit(sys.maxsize)
+    with ConfirmingPublisher(queue_name) as publisher, open_range(path, start, end) as f:
+        batcher = RowBatcher(publisher.publish, fields=envelope_fields(job_id, tenant_id))
+        return publish_rows(csv_records(csv.reader(f), build_projection(header, tenant_id)), tenant_id, batcher)
+
+
+def init_worker():
+    """Each worker runs its own log listener, so its warnings and reconnects are not lost."""
+    setup_logger("insertion-service", service="insertion-service")
+
+
+def should_parse_in_parallel(local_path):
+    return local_path is not None and PARSE_WORKERS > 1 and os.path.getsize(local_path) >= PARALLEL_PARSE_MIN_BYTES
+
+
+def parse_in_parallel(path, tenant_id, queue_name, job, workers=PARSE_WORKERS):
+    """
+    Parses a large local CSV file as `workers` shards in a process pool.
+    Each finished shard is recorded in the job registry, so a resumed job
+    only parses the shards it has not finished (shard ranges are the same
+    for the same file and worker count). Workers are spawned, not forked:
+    the service forks from an ingest thread while other threads hold locks
+    (logging queue, other jobs' publishers), which a forked child inherits
+    held.
+    """
+    header_end, ranges = shard_ranges(path, workers)
+    header = read_header(path, header_end)
+    if header is None:
+        return 0
+
+    registry = get_registry()
+    done = {tuple(shard) for shard in job["shards_done"]}
+    ranges = [shard for shard in ranges if shard not in done]
+    logger.info(f"parsing {path} in {len(ranges)} shards ({len(done)} already done)", extra={"tenant_id": tenant_id})
+    if not ranges:
+        return 0
+
+    rows = 0
+    with ProcessPoolExecutor(max_workers=len(ranges), mp_context=multiprocessing.get_context("spawn"),
+                             initializer=init_worker) as pool:
+        futures = {
+            pool.submit(parse_shard, path, start, end, header, tenant_id, queue_name, job["job_id"]): (start, end)
+            for start, end in ranges
+        }
+        for future in as_completed(futures):
+            shard_rows = future.result()
+            registry.complete_shard(job["job_id"], futures[future], shard_rows)
+            rows += shard_rows
+    return rows
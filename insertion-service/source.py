@@ -0,0 +1,112 @@
+import io
+import logging
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# where storage-service's files volume is mounted; unset disables the local handoff
+SHARED_FILES_DIR = os.getenv("SHARED_FILES_DIR")
+READ_BUFFER_SIZE = int(os.getenv("READ_BUFFER_SIZE", str(1024 * 1024)))
+
+
+def resolve_local_path(payload):
+    """
+    The job's file on the shared volume, or None when the local handoff is
+    disabled, the path falls outside SHARED_FILES_DIR, or the file on disk
+    is missing or not the size storage-service published.
+    """
+    local_path = payload.get("local_path")
+    if not SHARED_FILES_DIR or not local_path:
+        return None
+
+    shared_dir = os.path.realpath(SHARED_FILES_DIR)
+    local_path = os.path.realpath(local_path)
+    if os.path.commonpath([shared_dir, local_path]) != shared_dir:
+        logger.warning(f"ignoring local_path outside {shared_dir}: {local_path}")
+        return None
+    try:
+        size = os.path.getsize(local_path)
+    except OSError:
+        return None
+    if payload.get("size") is not None and size != payload["size"]:
+        return None
+    return local_path
+
+
+class TrackedLines:
+    """
+    Decodes raw byte lines for csv.reader while counting the bytes consumed.
+    csv.reader never reads past the end of the record it returns, so after
+    each row `offset` is exactly where the next record starts in the file.
+    """
+
+    def __init__(self, raw_lines, offset=0):
+        self._raw_lines = raw_lines
+        self.offset = offset
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = next(self._raw_lines)
+        self.offset += len(line)
+        return line.decode("utf-8")
+
+
+def _skip(stream, count):
+    while count > 0:
+        skipped = len(stream.read(min(count, READ_BUFFER_SIZE)))
+        if not skipped:
+            return
+        count -= skipped
+
+
+@contextmanager
+def open_catalog(payload, offset=0):
+    """
+    Yields the uploaded file from byte `offset` on as an iterator of raw
+    byte lines: read straight off the shared volume when possible,
+    otherwise streamed from the HTTP URL (with a Range request, or by
+    skipping bytes when the server ignores it).
+    """
+    local_path = resolve_local_path(payload)
+    if local_path is not None:
+        logger.info(f"reading {local_path} from the shared volume")
+        with open(local_path, "rb", buffering=READ_BUFFER_SIZE) as f:
+            f.seek(offset)
+            yield iter(f)
+        return
+
+    headers = {"Range": f"bytes={offset}-"} if offset else None
+    with requests.get(payload["file_path"], stream=True, headers=headers) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        stream = io.BufferedReader(response.raw, buffer_size=READ_BUFFER_SIZE)
+        if offset and response.status_code != 206:
+            _skip(stream, offset)
+        yield iter(stream)
+
+
+@contextmanager
+def local_copy(payload):
+    """
+    A path to the whole file, for formats that need random access
+    (Parquet): the shared volume copy, or else a temporary download.
+    """
+    local_path = resolve_local_path(payload)
+    if local_path is not None:
+        yield local_path
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(payload["file_path"])[1]) as f:
+        with requests.get(payload["file_path"], stream=True) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            shutil.copyfileobj(response.raw, f, READ_BUFFER_SIZE)
+        f.flush()
+        yield f.name
@@ -1,5 +1,6 @@
 # main.py
-from fastapi import FastAPI, Query, Request, File, UploadFile
+from fastapi import FastAPI, Query, Request, File, UploadFile, Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import List, Optional
@@ -8,54 +9,45 @@ from services.model import get_model
 from repositories.qdrant.vectore_store import initiate_vector_store, create_collection
 import services.query as query_service
 import os
-from services.auth import get_tenant_id_from_token
+import hmac
+from common.auth import InvalidToken, get_authenticator, get_tenant_id_from_token, get_token_from_header
 from fastapi.responses import JSONResponse
 
 from opentelemetry import trace
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
-from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
-from opentelemetry.sdk.resources import SERVICE_NAME, Resource
-import logging
+from common.tracing import setup_tracing
+from common.compression import CompressionMiddleware
 import asyncio
-import psutil
 from prometheus_client import Gauge, Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
-from logging_conf import setup_logger
+from common.logging_conf import setup_logger
 from utils import do_some_heavy_task
+from services.warmup import warm_up_model, probe_vector_store
+from services.openai_llm import get_openai_client
+from services.singleflight import SingleFlight, normalize_query
+from common import profiler
 import time
+from contextlib import contextmanager
 from fastapi.responses import Response
 
 # --- Configuration ---
 OTEL_EXPORTER_OTLP_ENDPOINT = "http://jaeger:4318/v1/traces"
 OTEL_SERVICE_NAME = "main-service"
 
+# Loki Logging Setup: JSON lines, written from a background thread
+LOG_FILE = os.path.join("/var/log/fastapi", "app.log")
+logger = setup_logger("fastapi-app", log_file=LOG_FILE, service=OTEL_SERVICE_NAME)
+
 # --- OpenTelemetry Setup ---
-print(f"Initializing OpenTelemetry for service: {OTEL_SERVICE_NAME}")
-print(f"OTLP Exporter Endpoint: {OTEL_EXPORTER_OTLP_ENDPOINT}")
-
-resource = Resource(attributes={SERVICE_NAME: OTEL_SERVICE_NAME})
-otlp_exporter = OTLPSpanExporter(endpoint=OTEL_EXPORTER_OTLP_ENDPOINT)
-trace_provider = TracerProvider(resource=resource)
-span_processor = BatchSpanProcessor(otlp_exporter)
-trace_provider.add_span_processor(span_processor)
-trace.set_tracer_provider(trace_provider)
+logger.info(f"Initializing OpenTelemetry for service: {OTEL_SERVICE_NAME}")
+logger.info(f"OTLP Exporter Endpoint: {OTEL_EXPORTER_OTLP_ENDPOINT}")
+
+# the provider (and its exporter stack) is installed in startup_event; until then this is a proxy tracer
 tracer = trace.get_tracer(__name__)
 
 app = FastAPI()
+app.add_middleware(CompressionMiddleware)
 FastAPIInstrumentor.instrument_app(app)
 
-# Loki Logging Setup
-log_dir = "/var/log/fastapi"
-log_file = os.path.join(log_dir, "app.log")
-os.makedirs(log_dir, exist_ok=True)
-logging.basicConfig(
-    filename=log_file,
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s"
-)
-logger = logging.getLogger("fastapi-app")
-
 # --- Models ---
 class Result(BaseModel):
     product_id: str
@@ -90,6 +82,84 @@ QUERY_LATENCY = Histogram(
 )
 CPU_USAGE = Gauge("app_cpu_usage_percent", "Process CPU usage percent")
 MEMORY_USAGE = Gauge("app_memory_usage_bytes", "Process memory usage in bytes")
+STARTUP_PHASE_DURATION = Gauge(
+    "startup_phase_duration_seconds",
+    "Duration of each startup/warm-up phase",
+    ["phase"],
+)
+READY = Gauge("app_ready", "1 once warm-up has finished and the instance accepts traffic")
+QUERY_SINGLEFLIGHT = Counter(
+    "query_singleflight_total",
+    "/query executions by role: leaders run the query, followers share an in-flight leader's result",
+    ["role"],
+)
+QUERY_COALESCING_RATIO = Gauge("query_coalescing_ratio", "Share of /query requests served by coalescing onto an in-flight query")
+QUERY_IN_FLIGHT = Gauge("query_singleflight_in_flight", "Distinct queries currently executing")
+
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "true").lower() == "true"
+query_flights = SingleFlight()
+QUERY_IN_FLIGHT.set_function(query_flights.in_flight)
+query_roles = {"leader": 0, "follower": 0}
+
+PROCESS_START_TIME = time.time()
+WARMUP_RETRY_DELAY = 5
+
+readiness = {"ready": False, "phase": "starting", "error": None}
+
+@contextmanager
+def startup_phase(name):
+    readiness["phase"] = name
+    start_time = time.time()
+    yield
+    duration = time.time() - start_time
+    STARTUP_PHASE_DURATION.labels(phase=name).set(duration)
+    logger.info(f"startup phase {name} took {duration:.3f}s")
+
+def warm_up():
+    """
+    Everything the first real query would otherwise pay for lazily: model load,
+    Qdrant connection and collection check, dummy encodes and a probe search.
+    Runs in a worker thread; /ready reports 503 until it completes.
+    """
+    with startup_phase("model_load"):
+        model = get_model(model_name=os.getenv("MODEL_NAME"))
+
+    collection_name = os.getenv("COLLECTION_NAME")
+    with startup_phase("qdrant_connect"):
+        qdrant_client = initiate_vector_store()
+        if not qdrant_client.collection_exists(collection_name=collection_name):
+            create_collection(client=qdrant_client, collection_name=collection_name)
+        else:
+            logger.info("collection already exists!!!")
+
+    with startup_phase("auth_keys"):
+        get_authenticator()
+
+    with startup_phase("llm_clients"):
+        get_openai_client()
+
+    with startup_phase("model_warmup"):
+        warm_up_model(model)
+
+    with startup_phase("qdrant_probe"):
+        probe_vector_store(qdrant_client, collection_name, model.get_sentence_embedding_dimension())
+
+async def run_warm_up():
+    delay = WARMUP_RETRY_DELAY
+    while True:
+        try:
+            await asyncio.to_thread(warm_up)
+            break
+        except Exception as e:
+            readiness["error"] = str(e)
+            logger.exception(f"warm-up failed in phase {readiness['phase']}, retrying in {delay}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+    STARTUP_PHASE_DURATION.labels(phase="total").set(time.time() - PROCESS_START_TIME)
+    readiness.update(ready=True, phase="ready", error=None)
+    READY.set(1)
+    logger.info("warm-up finished, instance is ready")
 
 # --- Startup Event ---
 @app.on_event("startup")
@@ -97,23 +167,16 @@ async def startup_event():
     # Load environment variables
     load_dotenv()
     os.makedirs(STATIC_DIR, exist_ok=True)
-    get_model(model_name=os.getenv("MODEL_NAME"))
+    with startup_phase("tracing_setup"):
+        setup_tracing(OTEL_SERVICE_NAME, OTEL_EXPORTER_OTLP_ENDPOINT)
 
-    # Initialize Qdrant
-    collection_name = os.getenv("COLLECTION_NAME")
-    print("initializing qdrant ...")
-    qdrant_client = initiate_vector_store()
-    print("qdrant_client", qdrant_client)
-    print("qdrant initialized!!!")
+    # Warm up in the background so /healthcheck (liveness) answers immediately
+    asyncio.create_task(run_warm_up())
 
-    if not qdrant_client.collection_exists(collection_name=collection_name):
-        create_collection(client=qdrant_client, collection_name=collection_name)
-    else:
-        print("collection already exists!!!")
-
-        
     # Start metrics collector
     async def collect_metrics():
+        import psutil
+
         while True:
             CPU_USAGE.set(psutil.cpu_percent(interval=None))
             MEMORY_USAGE.set(psutil.Process().memory_info().rss)
@@ -143,12 +206,20 @@ async def add_metrics_middleware(request: Request, call_next):
 
     return response
 
-app.add_event_handler("startup", startup_event)
+@app.exception_handler(InvalidToken)
+async def invalid_token_handler(request: Request, exc: InvalidToken):
+    return JSONResponse(status_code=401, content={"detail": f"invalid token: {exc}"})
 
 @app.get("/healthcheck", tags=["Health"])
 async def healthcheck():
     return JSONResponse(status_code=200, content={"status": "ok"})
 
+@app.get("/ready", tags=["Health"])
+async def ready():
+    if not readiness["ready"]:
+        return JSONResponse(status_code=503, content={"status": "warming_up", "phase": readiness["phase"], "error": readiness["error"]})
+    return JSONResponse(status_code=200, content={"status": "ready"})
+
 
 # Mount the static files directory
 app.mount("/files", StaticFiles(directory=STATIC_DIR), name="static")
@@ -159,19 +230,39 @@ async def read_root():
     logger.info("Request to root path")
     return {"message": "Hello from FastAPI!"}
 
+def record_flight_role(role):
+    QUERY_SINGLEFLIGHT.labels(role=role).inc()
+    query_roles[role] += 1
+    QUERY_COALESCING_RATIO.set(query_roles["follower"] / (query_roles["leader"] + query_roles["follower"]))
+
+async def run_query(query, tenant_id):
+    """
+    Runs the guardrail -> rewrite -> embed -> search chain off the event loop.
+    Identical in-flight queries for the same tenant share one execution.
+    """
+    async def execute():
+        results = await run_in_threadpool(query_service.query, query, tenant_id, tracer)
+        return [Result(product_id=result.id, score=result.score, payload=result.payload) for result in results]
+
+    if not SINGLEFLIGHT_ENABLED:
+        return await execute()
+
+    results, shared = await query_flights.do((tenant_id, normalize_query(query)), execute)
+    record_flight_role("follower" if shared else "leader")
+    return results
+
 @app.get("/query", response_model=QueryResponse)
-async def query_endpoint(query: Optional[str] = Query(default=None)):
+async def query_endpoint(query: Optional[str] = Query(default=None), authorization: Optional[str] = Header(default=None)):
     results = []
     with tracer.start_as_current_span("embedding_model_load") as span:
-        tenant_id = get_tenant_id_from_token("mock-token")
+        tenant_id = get_tenant_id_from_token(get_token_from_header(authorization))
         span.set_attribute("tenant_id", tenant_id)
         span.set_attribute("Query", query)
 
-        results = query_service.query(query, tenant_id, tracer)
-        results = [Result(product_id=result.id, score=result.score, payload=result.payload) for result in results]
+        results = await run_query(query, tenant_id)
 
-        span.set_attribute("results", results)
-        print(results)
+        span.set_attribute("results_count", len(results))
+        logger.debug("query served", extra={"tenant_id": tenant_id, "results_count": len(results)})
 
     return QueryResponse(data=results)
 
@@ -191,3 +282,48 @@ async def slow_task():
 @app.get("/metrics")
 async def metrics():
     return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+# --- Debug / Profiling ---
+def require_debug_token(token):
+    # debug endpoints are disabled unless a DEBUG_TOKEN is configured
+    debug_token = os.getenv("DEBUG_TOKEN")
+    if not debug_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest((token or "").encode(), debug_token.encode()):
+        raise HTTPException(status_code=403, detail="Invalid debug token")
+
+@app.get("/debug/profile/cpu")
+async def profile_cpu(
+    seconds: float = Query(default=10, gt=0, le=profiler.MAX_PROFILE_SECONDS),
+    format: str = Query(default="speedscope", pattern="^(speedscope|collapsed)$"),
+    x_debug_token: Optional[str] = Header(default=None),
+):
+    require_debug_token(x_debug_token)
+    # sampled from a worker thread so the event loop keeps serving (and shows up in the profile)
+    try:
+        result = await run_in_threadpool(profiler.profile_cpu, seconds, format)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    if format == "collapsed":
+        return Response(result, media_type="text/plain")
+    return JSONResponse(
+        content=result,
+        headers={"Content-Disposition": f"attachment; filename=cpu-{int(time.time())}.speedscope.json"},
+    )
+
+@app.get("/debug/profile/memory")
+async def profile_memory(
+    limit: int = Query(default=25, gt=0, le=500),
+    diff: bool = Query(default=False),
+    x_debug_token: Optional[str] = Header(default=None),
+):
+    require_debug_token(x_debug_token)
+    return await run_in_threadpool(profiler.memory_snapshot, limit, diff)
+
+@app.delete("/debug/profile/memory")
+async def stop_memory_profile(x_debug_token: Optional[str] = Header(default=None)):
+    require_debug_token(x_debug_token)
+    profiler.stop_memory_tracing()
+    return {"status": "stopped"}
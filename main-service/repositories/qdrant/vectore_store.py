@@ -1,6 +1,3 @@
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams
-from qdrant_client.models import PointStruct
 import os
 
 vector_client = None
@@ -8,11 +5,14 @@ vector_client = None
 def initiate_vector_store():
     ""
     global vector_client
+    from qdrant_client import QdrantClient
+
     vector_client = QdrantClient(url=os.getenv("QDRANT_URL"))
 
     return vector_client
 
 def create_collection(client,collection_name):
+    from qdrant_client.models import Distance, VectorParams
 
     client.create_collection(
         collection_name=collection_name,
@@ -40,6 +40,8 @@ def get_client():
 
 def prepare_qdrant_point_from_payload_descriptions(model,payloads,get_embeddings_func):
     ""
+    from qdrant_client.models import PointStruct
+
     points = []
     for payload in payloads:
         text_for_embeddings = payload["text"]
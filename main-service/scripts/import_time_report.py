@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Import-time report for main-service.
+
+Runs `python -X importtime -c "import app"` in a fresh interpreter and
+summarises where the time goes, grouped by top-level package, plus the
+slowest individual modules. With --budget-ms it exits non-zero when the
+total import time exceeds the budget, so it can gate CI or a Docker build.
+
+    python scripts/import_time_report.py
+    python scripts/import_time_report.py --module app --top 25 --budget-ms 1500
+"""
+
+import argparse
+import collections
+import os
+import subprocess
+import sys
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_importtime(module):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SERVICE_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr)
+        raise SystemExit(f"importing {module} failed")
+    return result.stderr
+
+
+def parse_importtime(output):
+    """Returns (module, self_us, cumulative_us, depth) for every `import time:` line."""
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return entries
+
+
+def summarise(entries, top):
+    by_package = collections.Counter()
+    for name, self_us, _, _ in entries:
+        by_package[name.split(".")[0]] += self_us
+
+    # depth 0 entries are the imports made directly by the interpreter/-c; their cumulative times add up to the total
+    total_us = sum(cumulative_us for _, _, cumulative_us, depth in entries if depth == 0)
+    slowest = sorted(entries, key=lambda entry: entry[2], reverse=True)[:top]
+    return total_us, by_package.most_common(top), slowest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app", help="module to import (default: app)")
+    parser.add_argument("--top", type=int, default=20, help="rows to show per table")
+    parser.add_argument("--budget-ms", type=float, default=None, help="fail if total import time exceeds this")
+    args = parser.parse_args()
+
+    total_us, packages, slowest = summarise(parse_importtime(run_importtime(args.module)), args.top)
+
+    print(f"total import time for '{args.module}': {total_us / 1000:.1f} ms\n")
+    print(f"{'package':<40} {'self ms':>10} {'share':>7}")
+    for package, self_us in packages:
+        print(f"{package:<40} {self_us / 1000:>10.1f} {self_us / max(total_us, 1):>7.1%}")
+
+    print(f"\n{'module':<60} {'cumulative ms':>14}")
+    for name, _, cumulative_us, _ in slowest:
+        print(f"{name:<60} {cumulative_us / 1000:>14.1f}")
+
+    if args.budget_ms is not None and total_us / 1000 > args.budget_ms:
+        print(f"\nFAIL: {total_us / 1000:.1f} ms exceeds the {args.budget_ms:.0f} ms budget")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +0,0 @@
-def get_tenant_id_from_token(token):
-    # mock token parsing
-
-    return "mock_tenant_1"
\ No newline at end of file
@@ -1,18 +1,24 @@
 import os
-import openai
 from dotenv import load_dotenv
 load_dotenv()
 
-from groq import Groq
+client = None
 
-client = Groq(
-    api_key=os.environ.get("GROQ_API_KEY"),
-)
 
+def get_client():
+    # built on first use instead of at import time
+    global client
+    if client is None:
+        from groq import Groq
 
+        client = Groq(
+            api_key=os.environ.get("GROQ_API_KEY"),
+        )
+    return client
 
 
 def redefine_query(query):
+    client = get_client()
     chat_completion = client.chat.completions.create(
     messages=[
         {
@@ -1,16 +1,66 @@
-from sentence_transformers import SentenceTransformer
+import os
+import logging
+import shutil
+import uuid
 
+logger = logging.getLogger(__name__)
 
 model = None
 
+
+def get_local_model_path(model_name):
+    """Directory the model is saved to under MODEL_CACHE_DIR, or None when no cache dir is configured."""
+    cache_dir = os.getenv("MODEL_CACHE_DIR")
+    if not cache_dir:
+        return None
+    return os.path.join(cache_dir, model_name.replace("/", "__"))
+
+
 def get_model(model_name):
-    ""
+    """
+    Loads the model once per process. With MODEL_CACHE_DIR set, the first
+    start saves the model there and later starts load it from disk, so
+    startup no longer depends on reaching the Hugging Face Hub.
+    """
     global model
     
     if model != None:
         return model
+
+    # torch/transformers take seconds to import; keep them out of app import
+    from sentence_transformers import SentenceTransformer
     
+    local_path = get_local_model_path(model_name)
+    if local_path and os.path.exists(os.path.join(local_path, "modules.json")):
+        logger.info(f"loading model from local cache {local_path}")
+        model = SentenceTransformer(local_path)
+        return model
+
     model = SentenceTransformer(model_name)
+    if local_path:
+        save_to_cache(model, local_path)
 
-    
-    return model
\ No newline at end of file
+    return model
+
+
+def save_to_cache(model, local_path):
+    """
+    Saves into a temporary directory on the same volume and renames it into
+    place, so a replica starting at the same time never sees a half-written
+    model behind an existing modules.json.
+    """
+    temp_path = f"{local_path}.tmp-{uuid.uuid4().hex}"
+    try:
+        model.save(temp_path)
+        if os.path.isdir(local_path) and not os.path.exists(os.path.join(local_path, "modules.json")):
+            # left behind by an interrupted save from before the rename
+            shutil.rmtree(local_path, ignore_errors=True)
+        os.rename(temp_path, local_path)
+        logger.info(f"saved model to local cache {local_path}")
+    except OSError:
+        if os.path.exists(os.path.join(local_path, "modules.json")):
+            logger.info(f"another replica cached the model at {local_path} first")
+        else:
+            logger.exception(f"could not save model to {local_path}")
+    finally:
+        shutil.rmtree(temp_path, ignore_errors=True)
@@ -1,5 +1,20 @@
-from openai import OpenAI
+import logging
 from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+openai_client = None
+
+
+def get_openai_client():
+    # one client (and connection pool) per process, imported on first use
+    global openai_client
+    if openai_client is None:
+        from openai import OpenAI
+
+        openai_client = OpenAI()
+    return openai_client
+
 instructions = """
 YOU ARE A HELPFUL ASSISTANT THAT STANDARDIZES SEARCH QUERIES SO THAT THEY CAN BE USED IN A SEARCH ENGINE.
 You will return a final query that can be used in a search engine.
@@ -8,16 +23,16 @@ The search text that you return needs to be in english.
 """
 
 def standardize_query(query: str, tracer) -> str:
-    client = OpenAI()
+    client = get_openai_client()
     response = client.responses.create(
         instructions=instructions,
         model='gpt-4.1-mini',
         input=query
     )
     with tracer.start_as_current_span("standardization") as span:
-        print(response.usage.input_tokens)
-        print(response.usage.output_tokens)
-        print(response.usage.total_tokens)
+        if not span.is_recording():
+            return response.output_text
+
         # Define pricing per million tokens
         input_cost_per_million = 0.10
         output_cost_per_million = 0.40
@@ -28,7 +43,7 @@ def standardize_query(query: str, tracer) -> str:
         input_cost = (input_tokens / 1000000) * input_cost_per_million
         output_cost = (output_tokens / 1000000) * output_cost_per_million
         total_cost = input_cost + output_cost
-        print("cost: ", total_cost)
+        logger.debug("standardization cost", extra={"cost": total_cost, "total_tokens": response.usage.total_tokens})
         span.set_attribute("cost", total_cost)
         span.set_attribute("input_cost", input_cost)
         span.set_attribute("output_cost", output_cost)        
@@ -45,7 +60,7 @@ def guardrail(query: str) -> str:
     Ensures queries are focused on product searches and filters out potentially unsafe or off-topic queries.
     Returns a safe product-focused query or an error message if the query is deemed unsafe.
     """
-    client = OpenAI()
+    client = get_openai_client()
     
     guardrail_instructions = """
     YOUR TASK IS TO DETERMINE IF A SEARCH QUERY IS APPROPRIATE FOR PRODUCT SEARCH.
@@ -2,15 +2,13 @@ from repositories.qdrant.vectore_store import get_client
 from services.model import get_model
 from services.embedding import get_embeddings
 import os
-from qdrant_client import models
-from qdrant_client.models import Filter, FieldCondition, MatchValue
-from services.llm import redefine_query
 from services.openai_llm import standardize_query,guardrail
 from fastapi import HTTPException
 
 
 
 def query(query_text,tenant_id, tracer):
+    from qdrant_client import models
     
     search_result = []
 
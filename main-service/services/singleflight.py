@@ -0,0 +1,39 @@
+import asyncio
+
+
+def normalize_query(query):
+    """Case- and whitespace-insensitive form of a query, used as the coalescing key."""
+    return " ".join((query or "").lower().split())
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one execution.
+    The first caller (the leader) starts the work as its own task; callers
+    arriving while it is in flight await the same task and get the same
+    result or exception. A caller that is cancelled (e.g. the client went
+    away) does not cancel the shared work for the others.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    def in_flight(self):
+        return len(self._calls)
+
+    async def do(self, key, coroutine_fn):
+        """Returns (result, shared) where shared is True for callers that joined an in-flight call."""
+        task = self._calls.get(key)
+        shared = task is not None
+        if not shared:
+            task = asyncio.ensure_future(coroutine_fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task), shared
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # mark the exception as retrieved in case every caller was cancelled
+        if not task.cancelled():
+            task.exception()
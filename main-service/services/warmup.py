@@ -0,0 +1,32 @@
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+WARMUP_TEXT = "warm-up query for a product search"
+
+
+def get_warmup_batch_sizes():
+    return [int(size) for size in os.getenv("WARMUP_BATCH_SIZES", "1,8,32").split(",") if size.strip()]
+
+
+def warm_up_model(model, batch_sizes=None):
+    """
+    Runs dummy encodes at the batch sizes queries and ingestion typically use,
+    so tokenizer loading and the first torch kernel dispatch for each shape
+    happen before the instance is marked ready.
+    """
+    for batch_size in batch_sizes or get_warmup_batch_sizes():
+        model.encode([WARMUP_TEXT] * batch_size)
+        logger.info(f"model warmed up at batch size {batch_size}")
+
+
+def probe_vector_store(client, collection_name, vector_size):
+    """Opens the Qdrant connection and runs one cheap search so the first real query doesn't pay for it."""
+    return client.query_points(
+        collection_name=collection_name,
+        query=[0.0] * vector_size,
+        with_payload=False,
+        with_vectors=False,
+        limit=1,
+    )
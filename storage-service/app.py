@@ -8,85 +8,230 @@
 # then make the auth api
 
 # main.py
-from fastapi import FastAPI,  File, UploadFile
+from fastapi import FastAPI,  File, UploadFile, Header, Request
+from typing import Optional
 from fastapi.responses import JSONResponse
-import shutil
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 import os
 import uuid
-from publisher import publish_to_mq
-import json
-from auth import get_tenant_id_from_token
+from publisher import OutboxFull, check_publish_capacity, get_publisher, publish_to_mq, stop_publisher
+from storage import write_upload, move_into_place, discard, safe_file_name, detect_format, find_ingested, record_ingested, UPLOAD_INDEX_DIR
+import uploads
+from pydantic import BaseModel
+from common import codec
+from common.jobs import get_registry, progress, PARSED
+from common.auth import InvalidToken, get_authenticator, get_tenant_id_from_token, get_token_from_header
 from opentelemetry import trace
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
-from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
-from opentelemetry.sdk.resources import SERVICE_NAME, Resource
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from fastapi.responses import Response
+from common.logging_conf import setup_logger
+from common.tracing import setup_tracing
 
 load_dotenv()
 
 OTEL_EXPORTER_OTLP_ENDPOINT = "http://jaeger:4318/v1/traces"
 OTEL_SERVICE_NAME = "storage-service"
 
+logger = setup_logger(__name__, service=OTEL_SERVICE_NAME)
+
 # --- OpenTelemetry Setup ---
-print(f"Initializing OpenTelemetry for service: {OTEL_SERVICE_NAME}")
-print(f"OTLP Exporter Endpoint: {OTEL_EXPORTER_OTLP_ENDPOINT}")
-
-resource = Resource(attributes={SERVICE_NAME: OTEL_SERVICE_NAME})
-otlp_exporter = OTLPSpanExporter(endpoint=OTEL_EXPORTER_OTLP_ENDPOINT)
-trace_provider = TracerProvider(resource=resource)
-span_processor = BatchSpanProcessor(otlp_exporter)
-trace_provider.add_span_processor(span_processor)
-trace.set_tracer_provider(trace_provider)
+logger.info(f"Initializing OpenTelemetry for service: {OTEL_SERVICE_NAME}")
+logger.info(f"OTLP Exporter Endpoint: {OTEL_EXPORTER_OTLP_ENDPOINT}")
+
+trace_provider = setup_tracing(OTEL_SERVICE_NAME, OTEL_EXPORTER_OTLP_ENDPOINT)
 tracer = trace.get_tracer(__name__)
 
 app = FastAPI()
 FastAPIInstrumentor.instrument_app(app)
 
 
-STATIC_DIR = "files"
-UPLOAD_DIR = "files"
+# uploads land here and are served under /files; resumable sessions (uploads.UPLOAD_SESSIONS_DIR)
+# must sit on the same filesystem so committing one is a rename, not a copy
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "files")
+STATIC_DIR = UPLOAD_DIR
+# StaticFiles checks the directory when it is mounted, before startup_event runs
+os.makedirs(STATIC_DIR, exist_ok=True)
 def startup_event():
     os.makedirs(STATIC_DIR, exist_ok=True)
+    os.makedirs(UPLOAD_INDEX_DIR, exist_ok=True)
+    os.makedirs(uploads.UPLOAD_SESSIONS_DIR, exist_ok=True)
+    get_registry()
+    # loads the signing keys before the first upload (no-op without AUTH_JWKS_URL)
+    get_authenticator()
+    # connects to RabbitMQ once, in the background, instead of on every upload
+    get_publisher()
+
+def shutdown_event():
+    stop_publisher()
 
 
 
 
 app.add_event_handler("startup", startup_event)
+app.add_event_handler("shutdown", shutdown_event)
 
 
 
 # Mount the static files directory
 app.mount("/files", StaticFiles(directory=STATIC_DIR), name="static")
 
+@app.exception_handler(InvalidToken)
+async def invalid_token_handler(request: Request, exc: InvalidToken):
+    return JSONResponse(status_code=401, content={"detail": f"invalid token: {exc}"})
+
+@app.exception_handler(OutboxFull)
+async def outbox_full_handler(request: Request, exc: OutboxFull):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "5"})
+
 @app.get("/healthcheck", tags=["Health"])
 async def healthcheck():
     return JSONResponse(status_code=200, content={"status": "ok"})
 
+@app.get("/metrics")
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(file: UploadFile = File(...), authorization: Optional[str] = Header(default=None)):
 
     with tracer.start_as_current_span("embedding_model_load") as span:
-        tenant_id = get_tenant_id_from_token("mock-token")
+        tenant_id = get_tenant_id_from_token(get_token_from_header(authorization))
         
-        file_location = f"{UPLOAD_DIR}/{file.filename}"
+        file_name = safe_file_name(file.filename)
         span.set_attribute("tenant_id", tenant_id)
-        span.set_attribute("file_name", file.filename)
-        
-        with open(file_location, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        span.set_attribute("file_name", file_name)
         
-        message = json.dumps({
-
-        "payload":{
-        "file_path":f"http://storage-service:8001/{UPLOAD_DIR}/{file.filename}",
-        "tenant_id":tenant_id
-
-        }})
-        
-        publish_to_mq(message)
+        # 503 before streaming the body when the parse job could not be queued anyway
+        check_publish_capacity()
+        # received next to the upload sessions: on the same volume as UPLOAD_DIR, but never served
+        temp_location, content_hash, size = await write_upload(file, uploads.UPLOAD_SESSIONS_DIR)
+        return await finalize_upload(span, tenant_id, file_name, temp_location, content_hash, size, file.content_type)
+
+def discard_stored(stored_path):
+    discard(stored_path)
+    try:
+        os.rmdir(os.path.dirname(stored_path))
+    except OSError:
+        pass
+
+def was_parsed(record):
+    """
+    Only content whose parse job finished counts as ingested: a failed job,
+    or one still queued, must not turn a re-upload away as a duplicate.
+    """
+    job = get_registry().get(record["job_id"]) if record.get("job_id") else None
+    return job is not None and job["status"] == PARSED
+
+async def finalize_upload(span, tenant_id, file_name, temp_location, content_hash, size, content_type=None):
+    """
+    Moves a fully received file into place and publishes its parse job,
+    unless it is byte-identical to the tenant's latest ingested upload.
+    """
+    span.set_attribute("content_hash", content_hash)
+    span.set_attribute("size", size)
+    file_format = detect_format(file_name, content_type)
+    span.set_attribute("format", file_format)
+
+    # a byte-identical re-upload of the catalog last ingested: nothing to re-ingest
+    previous = await run_in_threadpool(find_ingested, tenant_id, content_hash)
+    if previous is not None and await run_in_threadpool(was_parsed, previous):
+        discard(temp_location)
+        span.set_attribute("duplicate", True)
+        logger.info("skipping duplicate upload", extra={"tenant_id": tenant_id, "sha256": content_hash})
+        return JSONResponse(content={
+            "filename": file_name,
+            "message": "File is identical to the latest upload, no re-ingest needed",
+            "duplicate": True,
+            "sha256": content_hash,
+            "job_id": previous["job_id"],
+        })
+
+    job_id = uuid.uuid4().hex
+    span.set_attribute("job_id", job_id)
+    # one directory per job: a later upload with the same name must not change
+    # the bytes a resumed job seeks into by checkpoint offset
+    stored_path = os.path.join(UPLOAD_DIR, job_id, file_name)
+    await run_in_threadpool(os.makedirs, os.path.dirname(stored_path), exist_ok=True)
+    await run_in_threadpool(move_into_place, temp_location, stored_path)
+    await run_in_threadpool(get_registry().create, job_id, tenant_id, file_name)
     
-
-    return JSONResponse(content={"filename": file.filename, "message": "File uploaded successfully"})
\ No newline at end of file
+    message, properties = codec.encode({
+
+    "payload":{
+    "file_path":f"http://storage-service:8001/files/{job_id}/{file_name}",
+    "tenant_id":tenant_id,
+    "job_id":job_id,
+    "content_hash":content_hash,
+    # same file on the shared volume, so insertion-service can skip the HTTP re-download
+    "local_path":os.path.abspath(stored_path),
+    "size":size,
+    "format":file_format
+
+    }})
+    
+    # indexed once RabbitMQ has confirmed the parse job; it blocks re-uploads only after that job is parsed
+    try:
+        publish_to_mq(message, properties, on_confirm=lambda: record_ingested(tenant_id, content_hash, file_name, size, job_id))
+    except OutboxFull as e:
+        # the outbox filled up since the upload was checked: nothing will ever parse this job
+        await run_in_threadpool(get_registry().finish, job_id, error=e)
+        await run_in_threadpool(discard_stored, stored_path)
+        raise
+
+    return JSONResponse(content={"filename": file_name, "message": "File uploaded successfully", "duplicate": False, "sha256": content_hash, "job_id": job_id, "format": file_format})
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str, authorization: Optional[str] = Header(default=None)):
+    """Progress of an ingest job: rows parsed, published, embedded and stored, and rows/sec."""
+    tenant_id = get_tenant_id_from_token(get_token_from_header(authorization))
+    job = await run_in_threadpool(get_registry().get, job_id)
+    if job is None or job["tenant_id"] != tenant_id:
+        return JSONResponse(status_code=404, content={"detail": "unknown job"})
+    return progress(job)
+
+# --- Resumable uploads: initiate, PUT parts at offsets (any order, retry freely), commit ---
+class InitiateUploadRequest(BaseModel):
+    filename: str
+    size: int
+    content_type: Optional[str] = None
+
+@app.exception_handler(uploads.UploadError)
+async def upload_error_handler(request: Request, exc: uploads.UploadError):
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail})
+
+@app.post("/uploads")
+async def initiate_upload(body: InitiateUploadRequest, authorization: Optional[str] = Header(default=None)):
+    tenant_id = get_tenant_id_from_token(get_token_from_header(authorization))
+    session = await run_in_threadpool(uploads.create_session, tenant_id, safe_file_name(body.filename), body.size, body.content_type)
+    return JSONResponse(status_code=201, content=session)
+
+@app.get("/uploads/{upload_id}")
+async def upload_status(upload_id: str, authorization: Optional[str] = Header(default=None)):
+    tenant_id = get_tenant_id_from_token(get_token_from_header(authorization))
+    session = await run_in_threadpool(uploads.load_session, upload_id, tenant_id)
+    return uploads.status(session)
+
+@app.put("/uploads/{upload_id}/parts")
+async def upload_part(upload_id: str, request: Request, offset: int, authorization: Optional[str] = Header(default=None)):
+    tenant_id = get_tenant_id_from_token(get_token_from_header(authorization))
+    return await uploads.write_part(upload_id, tenant_id, offset, request.stream())
+
+@app.post("/uploads/{upload_id}/commit")
+async def commit_upload(upload_id: str, authorization: Optional[str] = Header(default=None)):
+    with tracer.start_as_current_span("commit_upload") as span:
+        tenant_id = get_tenant_id_from_token(get_token_from_header(authorization))
+        span.set_attribute("tenant_id", tenant_id)
+        # checked before the session is consumed, so a 503 leaves the upload committable later
+        check_publish_capacity()
+        session, data_location, content_hash = await uploads.commit(upload_id, tenant_id)
+        span.set_attribute("file_name", session["file_name"])
+        return await finalize_upload(span, tenant_id, session["file_name"], data_location, content_hash, session["size"], session.get("content_type"))
+
+@app.delete("/uploads/{upload_id}")
+async def abort_upload(upload_id: str, authorization: Optional[str] = Header(default=None)):
+    tenant_id = get_tenant_id_from_token(get_token_from_header(authorization))
+    await uploads.abort(upload_id, tenant_id)
+    return {"upload_id": upload_id, "aborted": True}
\ No newline at end of file
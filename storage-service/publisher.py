@@ -1,26 +1,188 @@
 import pika
-from mq import create_connection, create_channel, create_queue 
-def publish_to_mq(message):
-    ""
-    connection = create_connection()
-    producer_channel = create_channel(connection)
-    queue_name = "parse_csv_queue"
-    create_queue(producer_channel,queue_name)
-
-    print("queue name",)
-    producer_channel.basic_publish(
-        exchange='',
-        routing_key=queue_name,
-        body=message,
-        properties=pika.BasicProperties(
-            delivery_mode=2,  # Make message persistent
-        )
-    )
-
-    
-
-    print(f"[x] Sent: {message}")
-    connection.close()
-
-    # Close connection
-    
+import logging
+import os
+import queue
+import threading
+import time
+from pika.exceptions import AMQPError, NackError, UnroutableError
+from prometheus_client import Counter, Gauge, Histogram
+from mq import create_connection, create_channel, create_queue
+
+logger = logging.getLogger(__name__)
+
+QUEUE_NAME = "parse_csv_queue"
+
+OUTBOX_DEPTH = Gauge("storage_publisher_outbox_depth", "Parse jobs waiting in the local outbox")
+PUBLISHED = Counter("storage_publisher_published_total", "Parse jobs confirmed by RabbitMQ")
+PUBLISH_FAILURES = Counter("storage_publisher_failures_total", "Failed publish attempts (retried)", ["reason"])
+RECONNECTS = Counter("storage_publisher_reconnects_total", "Publisher (re)connections to RabbitMQ")
+CONFIRM_LATENCY = Histogram(
+    "storage_publisher_confirm_seconds",
+    "Time from basic_publish to broker confirm",
+    buckets=[0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1],
+)
+
+
+class OutboxFull(Exception):
+    pass
+
+
+class Publisher:
+    """
+    Owns one long-lived RabbitMQ connection on a dedicated thread; pika
+    connections are not thread-safe, so request handlers only put messages
+    into a bounded outbox and return.
+
+    The channel runs in confirm mode. A message leaves the outbox only once
+    the broker has confirmed it; on a nack or a dropped connection it is
+    retried, after reconnecting with exponential backoff if needed. While
+    RabbitMQ is briefly unavailable the outbox absorbs up to `outbox_size`
+    messages; beyond that publish() raises OutboxFull.
+    """
+
+    def __init__(self, queue_name=QUEUE_NAME, outbox_size=1000, max_backoff=30.0):
+        self.queue_name = queue_name
+        self.max_backoff = max_backoff
+        self._outbox = queue.Queue(maxsize=outbox_size)
+        self._pending = None
+        self._stopping = threading.Event()
+        self._connection = None
+        self._channel = None
+        self._thread = threading.Thread(target=self._run, name="mq-publisher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def publish(self, message, properties=None, on_confirm=None):
+        """
+        Queues a message; `properties` are extra BasicProperties fields such
+        as the codec's content_type. `on_confirm` runs on the publisher
+        thread once the broker has the message.
+        """
+        try:
+            self._outbox.put_nowait((message, properties, on_confirm))
+        except queue.Full:
+            PUBLISH_FAILURES.labels(reason="outbox_full").inc()
+            raise OutboxFull("publisher outbox is full, RabbitMQ may be unavailable")
+        OUTBOX_DEPTH.set(self._outbox.qsize())
+
+    def check_capacity(self):
+        """Raises OutboxFull up front, before a caller commits to work whose message could not be queued."""
+        if self._outbox.full():
+            PUBLISH_FAILURES.labels(reason="outbox_full").inc()
+            raise OutboxFull("publisher outbox is full, RabbitMQ may be unavailable")
+
+    def stop(self, timeout=10.0):
+        """Stops after flushing what is already queued, for at most `timeout` seconds."""
+        deadline = time.monotonic() + timeout
+        while (self._pending is not None or not self._outbox.empty()) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self._stopping.set()
+        self._thread.join(timeout=max(deadline - time.monotonic(), 0.1))
+
+    def _connect(self):
+        backoff = 0.5
+        while not self._stopping.is_set():
+            try:
+                self._connection = create_connection()
+                self._channel = create_channel(self._connection)
+                self._channel.confirm_delivery()
+                create_queue(self._channel, self.queue_name)
+                RECONNECTS.inc()
+                logger.info(f"publisher connected, declaring {self.queue_name}")
+                return True
+            except AMQPError:
+                PUBLISH_FAILURES.labels(reason="connect").inc()
+                logger.warning(f"publisher could not connect to RabbitMQ, retrying in {backoff:.1f}s")
+                self._stopping.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+        return False
+
+    def _disconnect(self):
+        try:
+            if self._connection is not None and self._connection.is_open:
+                self._connection.close()
+        except AMQPError:
+            pass
+        self._connection = None
+        self._channel = None
+
+    def _next_message(self):
+        if self._pending is None:
+            try:
+                self._pending = self._outbox.get(timeout=1.0)
+            except queue.Empty:
+                return None
+            OUTBOX_DEPTH.set(self._outbox.qsize())
+        return self._pending
+
+    def _run(self):
+        while not self._stopping.is_set():
+            if self._connection is None and not self._connect():
+                return
+
+            try:
+                item = self._next_message()
+                if item is None:
+                    # idle: keep heartbeats flowing on the long-lived connection
+                    self._connection.process_data_events(time_limit=0)
+                    continue
+
+                message, properties, on_confirm = item
+                start_time = time.monotonic()
+                self._channel.basic_publish(
+                    exchange='',
+                    routing_key=self.queue_name,
+                    body=message,
+                    properties=pika.BasicProperties(
+                        delivery_mode=2,  # Make message persistent
+                        **(properties or {})
+                    ),
+                    mandatory=True,
+                )
+                CONFIRM_LATENCY.observe(time.monotonic() - start_time)
+                PUBLISHED.inc()
+                self._pending = None
+                logger.info("[x] Sent parse job", extra={"queue": self.queue_name})
+                if on_confirm is not None:
+                    try:
+                        on_confirm()
+                    except Exception:
+                        logger.exception("publish confirm callback failed")
+            except (NackError, UnroutableError):
+                PUBLISH_FAILURES.labels(reason="nack").inc()
+                logger.warning("parse job was not confirmed by RabbitMQ, retrying")
+                self._stopping.wait(0.5)
+            except AMQPError:
+                PUBLISH_FAILURES.labels(reason="connection").inc()
+                logger.exception("publisher lost its RabbitMQ connection, reconnecting")
+                self._disconnect()
+
+        self._disconnect()
+
+
+publisher = None
+publisher_lock = threading.Lock()
+
+
+def get_publisher():
+    global publisher
+    with publisher_lock:
+        if publisher is None:
+            publisher = Publisher(outbox_size=int(os.getenv("PUBLISHER_OUTBOX_SIZE", "1000")))
+            publisher.start()
+    return publisher
+
+
+def stop_publisher():
+    if publisher is not None:
+        publisher.stop()
+
+
+def publish_to_mq(message, properties=None, on_confirm=None):
+    """Hands a parse job to the long-lived publisher; never waits on RabbitMQ. Raises OutboxFull."""
+    get_publisher().publish(message, properties=properties, on_confirm=on_confirm)
+
+
+def check_publish_capacity():
+    get_publisher().check_capacity()
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+
+from starlette.concurrency import run_in_threadpool
+
+# ingest formats insertion-service parses; anything unrecognised is treated as CSV
+CSV = "csv"
+JSONL = "jsonl"
+PARQUET = "parquet"
+FORMATS_BY_CONTENT_TYPE = {
+    "text/csv": CSV,
+    "application/x-ndjson": JSONL,
+    "application/jsonl": JSONL,
+    "application/jsonlines": JSONL,
+    "application/vnd.apache.parquet": PARQUET,
+    "application/x-parquet": PARQUET,
+}
+FORMATS_BY_EXTENSION = {
+    ".csv": CSV,
+    ".jsonl": JSONL,
+    ".ndjson": JSONL,
+    ".parquet": PARQUET,
+    ".pq": PARQUET,
+}
+
+CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+UPLOAD_INDEX_DIR = os.getenv("UPLOAD_INDEX_DIR", "upload_index")
+
+
+class HashingWriter:
+    """Writes chunks to a file and hashes them as they go; both run in a worker thread."""
+
+    def __init__(self, path):
+        self.path = path
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self.file = open(path, "wb")
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.hasher.update(chunk)
+        self.size += len(chunk)
+
+    def close(self):
+        self.file.close()
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+
+async def write_upload(upload_file, directory):
+    """
+    Streams an UploadFile to a temporary file in `directory` chunk by chunk,
+    keeping file I/O and hashing off the event loop. Returns
+    (temp_path, sha256_hex, size); the caller moves or removes the file.
+    """
+    temp_path = os.path.join(directory, f".upload-{uuid.uuid4().hex}.part")
+    writer = await run_in_threadpool(HashingWriter, temp_path)
+    try:
+        while True:
+            chunk = await upload_file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            await run_in_threadpool(writer.write, chunk)
+    except BaseException:
+        await run_in_threadpool(writer.close)
+        discard(temp_path)
+        raise
+    await run_in_threadpool(writer.close)
+    return temp_path, writer.hexdigest(), writer.size
+
+
+def discard(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def move_into_place(source, destination):
+    """A rename when both paths share a filesystem, a copy only when they don't."""
+    try:
+        os.replace(source, destination)
+    except OSError:
+        shutil.move(source, destination)
+
+
+def safe_file_name(file_name):
+    return os.path.basename(file_name or "") or f"upload-{uuid.uuid4().hex}"
+
+
+def detect_format(file_name, content_type=None):
+    """
+    The upload's ingest format: from its content type when that names one
+    (browsers and curl often send application/octet-stream instead), else
+    from the file extension.
+    """
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type in FORMATS_BY_CONTENT_TYPE:
+        return FORMATS_BY_CONTENT_TYPE[media_type]
+    return FORMATS_BY_EXTENSION.get(os.path.splitext(file_name)[1].lower(), CSV)
+
+
+def _index_path(tenant_id):
+    tenant_dir = re.sub(r"[^A-Za-z0-9_.-]", "_", tenant_id)
+    return os.path.join(UPLOAD_INDEX_DIR, tenant_dir, "latest.json")
+
+
+def find_ingested(tenant_id, content_hash):
+    """
+    The record of the tenant's latest upload if it is byte-identical, or None.
+    Only the latest counts: re-uploading an older catalog is a rollback and
+    must be ingested again, since later uploads changed (or, for full syncs,
+    deleted) its products.
+    """
+    try:
+        with open(_index_path(tenant_id)) as f:
+            record = json.load(f)
+    except FileNotFoundError:
+        return None
+    return record if record.get("sha256") == content_hash else None
+
+
+def record_ingested(tenant_id, content_hash, file_name, size, job_id):
+    """Remembers the upload with its job; it only counts as ingested once that job is parsed."""
+    path = _index_path(tenant_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump({"file_name": file_name, "size": size, "sha256": content_hash, "job_id": job_id, "uploaded_at": time.time()}, f)
+    os.replace(temp_path, path)
@@ -0,0 +1,181 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+
+from starlette.concurrency import run_in_threadpool
+
+from storage import CHUNK_SIZE, discard
+
+UPLOAD_SESSIONS_DIR = os.getenv("UPLOAD_SESSIONS_DIR", "upload_sessions")
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 ** 3)))
+PART_SIZE_HINT = int(os.getenv("UPLOAD_PART_SIZE_HINT", str(16 * 1024 * 1024)))
+
+_session_locks = {}
+
+
+class UploadError(Exception):
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _meta_path(upload_id):
+    return os.path.join(UPLOAD_SESSIONS_DIR, f"{upload_id}.json")
+
+
+def data_path(upload_id):
+    return os.path.join(UPLOAD_SESSIONS_DIR, f"{upload_id}.data")
+
+
+def _lock(upload_id):
+    lock = _session_locks.get(upload_id)
+    if lock is None:
+        lock = _session_locks[upload_id] = asyncio.Lock()
+    return lock
+
+
+def _save(session):
+    temp_path = _meta_path(session["upload_id"]) + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(session, f)
+    os.replace(temp_path, _meta_path(session["upload_id"]))
+
+
+def merge_range(ranges, start, end):
+    """Adds [start, end) to a sorted list of disjoint ranges, coalescing overlaps and neighbours."""
+    merged = []
+    for range_start, range_end in sorted(ranges + [[start, end]]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return merged
+
+
+def missing_ranges(session):
+    missing = []
+    position = 0
+    for start, end in session["received"]:
+        if start > position:
+            missing.append([position, start])
+        position = max(position, end)
+    if position < session["size"]:
+        missing.append([position, session["size"]])
+    return missing
+
+
+def status(session):
+    received = sum(end - start for start, end in session["received"])
+    return {
+        "upload_id": session["upload_id"],
+        "filename": session["file_name"],
+        "size": session["size"],
+        "received_bytes": received,
+        "missing": missing_ranges(session),
+        "complete": received == session["size"],
+    }
+
+
+def create_session(tenant_id, file_name, size, content_type=None):
+    """
+    Starts a resumable upload. The data file is created at its final size up
+    front (sparse where supported) so parts can be written straight to their
+    offsets and never need assembling afterwards.
+    """
+    if size <= 0 or size > MAX_UPLOAD_BYTES:
+        raise UploadError(413 if size > 0 else 400, f"size must be between 1 and {MAX_UPLOAD_BYTES} bytes")
+
+    os.makedirs(UPLOAD_SESSIONS_DIR, exist_ok=True)
+    session = {
+        "upload_id": uuid.uuid4().hex,
+        "tenant_id": tenant_id,
+        "file_name": file_name,
+        "size": size,
+        "content_type": content_type,
+        "received": [],
+        "created_at": time.time(),
+    }
+    with open(data_path(session["upload_id"]), "wb") as f:
+        f.truncate(size)
+    _save(session)
+    return dict(status(session), part_size_hint=PART_SIZE_HINT)
+
+
+def load_session(upload_id, tenant_id):
+    try:
+        with open(_meta_path(upload_id)) as f:
+            session = json.load(f)
+    except (FileNotFoundError, ValueError):
+        raise UploadError(404, "unknown upload")
+    if session["tenant_id"] != tenant_id:
+        raise UploadError(404, "unknown upload")
+    return session
+
+
+async def write_part(upload_id, tenant_id, offset, chunks):
+    """
+    Writes a part's body, as it streams in, directly at `offset` of the data
+    file with pwrite. Only the bytes actually written are marked received,
+    so an interrupted part can be resumed from the returned missing ranges.
+    """
+    session = await run_in_threadpool(load_session, upload_id, tenant_id)
+    if offset < 0 or offset >= session["size"]:
+        raise UploadError(400, f"offset must be in [0, {session['size']})")
+
+    fd = await run_in_threadpool(os.open, data_path(upload_id), os.O_WRONLY)
+    position = offset
+    try:
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            if position + len(chunk) > session["size"]:
+                raise UploadError(400, "part extends past the declared upload size")
+            await run_in_threadpool(os.pwrite, fd, chunk, position)
+            position += len(chunk)
+    finally:
+        await run_in_threadpool(os.close, fd)
+
+        if position > offset:
+            async with _lock(upload_id):
+                session = await run_in_threadpool(load_session, upload_id, tenant_id)
+                session["received"] = merge_range(session["received"], offset, position)
+                await run_in_threadpool(_save, session)
+
+    return status(session)
+
+
+def _hash_file(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+async def commit(upload_id, tenant_id):
+    """
+    Checks every byte has arrived and hands back (data_path, sha256, size)
+    for the caller to finalize. The session metadata is removed; the data
+    file is moved or discarded by the caller.
+    """
+    async with _lock(upload_id):
+        session = await run_in_threadpool(load_session, upload_id, tenant_id)
+        missing = missing_ranges(session)
+        if missing:
+            raise UploadError(409, {"message": "upload is incomplete", "missing": missing})
+        content_hash = await run_in_threadpool(_hash_file, data_path(upload_id))
+        await run_in_threadpool(discard, _meta_path(upload_id))
+    _session_locks.pop(upload_id, None)
+    return session, data_path(upload_id), content_hash
+
+
+async def abort(upload_id, tenant_id):
+    async with _lock(upload_id):
+        await run_in_threadpool(load_session, upload_id, tenant_id)
+        await run_in_threadpool(discard, data_path(upload_id))
+        await run_in_threadpool(discard, _meta_path(upload_id))
+    _session_locks.pop(upload_id, None)
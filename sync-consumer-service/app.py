@@ -1,11 +1,20 @@
 import pika
-import json
-from handler import handle
+from common import codec
+from handler import handle, SyncIncomplete
+import os
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from vector_store import get_client
 from model import get_model
 from vector_store import get_collection
 from vector_store import create_collection
-import traceback
+from common.profiler import install_signal_handlers
+from common.logging_conf import setup_logger
+
+logger = setup_logger("sync-consumer-service", service="sync-consumer-service")
+
+# how long an early end_of_sync marker waits before it is checked again
+END_OF_SYNC_RETRY_SECONDS = float(os.getenv("END_OF_SYNC_RETRY_SECONDS", "5"))
 
 
 vstore_client = get_client()
@@ -19,9 +28,9 @@ collection = get_collection(collection_name=collection_name,client=vstore_client
 
 if collection == None:
     collection = create_collection(client=vstore_client,collection_name=collection_name)
-    print("collection created !!")
+    logger.info("collection created !!")
 else:
-     print("collection already exists !!")
+     logger.info("collection already exists !!")
      
 connection = pika.BlockingConnection(pika.ConnectionParameters('rabbitmq'))
 channel = connection.channel()
@@ -30,13 +39,42 @@ channel = connection.channel()
 queue_name = 'product_sync'
 channel.queue_declare(queue=queue_name, durable=True)
 
-# Set prefetch count to 3 (i.e., only process 3 unacked messages at once)
-channel.basic_qos(prefetch_count=1)
-# Message handler
-def callback(ch, method, properties, body):
-    
-    message = body.decode('utf-8')
-    json_payload = json.loads(message)
+# end_of_sync markers that arrive before their rows are synced wait here, then dead-letter
+# back onto product_sync, instead of being requeued at its head and blocking other tenants
+retry_queue_name = 'product_sync_retry'
+channel.queue_declare(queue=retry_queue_name, durable=True, arguments={
+    "x-dead-letter-exchange": "",
+    "x-dead-letter-routing-key": queue_name,
+})
+
+# batches synced at once; each one embeds and upserts on its own worker thread
+SYNC_CONCURRENCY = int(os.getenv("SYNC_CONCURRENCY", "1"))
+channel.basic_qos(prefetch_count=SYNC_CONCURRENCY)
+executor = ThreadPoolExecutor(max_workers=SYNC_CONCURRENCY, thread_name_prefix="sync")
+
+
+def retry_later(body, properties, delivery_tag):
+    """Parks an early end_of_sync marker in the retry queue; runs on the connection's thread."""
+    channel.basic_publish(
+        exchange="",
+        routing_key=retry_queue_name,
+        body=body,
+        properties=pika.BasicProperties(
+            content_type=properties.content_type,
+            content_encoding=properties.content_encoding,
+            delivery_mode=2,
+            expiration=str(int(END_OF_SYNC_RETRY_SECONDS * 1000)),
+        ),
+    )
+    channel.basic_ack(delivery_tag=delivery_tag)
+
+
+def run_sync(json_payload, body, properties, delivery_tag):
+    """
+    Runs on an executor thread, so the connection keeps sending heartbeats
+    while a large batch is embedded. Acks and publishes are handed back to
+    the connection's own thread, since pika channels must only be used there.
+    """
     event = {
         "payload": json_payload,
         "event_name":"PROCESS"
@@ -49,20 +87,33 @@ def callback(ch, method, properties, body):
 
     try:
         response = handle(event=event, context=context)
-        print("qdrant response",response)
-    except Exception as e:
-            traceback.print_exc()
-     
+        logger.debug("qdrant response", extra={"response": response, "sample_rate": 0.01})
+    except SyncIncomplete:
+        # rows of the full sync are still in flight: retry the marker after a delay
+        connection.add_callback_threadsafe(functools.partial(retry_later, body, properties, delivery_tag))
+        return
+    except Exception:
+        logger.exception("failed to sync products")
+
+    connection.add_callback_threadsafe(functools.partial(channel.basic_ack, delivery_tag=delivery_tag))
+
+
+# Message handler
+def callback(ch, method, properties, body):
+    try:
+        json_payload = codec.decode(body, properties.content_type, properties.content_encoding)
+    except Exception:
+        # redelivering cannot fix an encoding this consumer does not understand
+        logger.exception("dropping undecodable product sync message")
+        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        return
 
-        
-        
-    # Simulate some processing if needed
-    # time.sleep(1)  # Optional delay
-    ch.basic_ack(delivery_tag=method.delivery_tag)
+    executor.submit(run_sync, json_payload, body, properties, method.delivery_tag)
 
 
 # Start consuming
+install_signal_handlers()
 channel.basic_consume(queue=queue_name, on_message_callback=callback)
 
-print('[*] Waiting for up to 3 messages at a time. To exit press CTRL+C')
+logger.info('[*] Waiting for messages. To exit press CTRL+C')
 channel.start_consuming()
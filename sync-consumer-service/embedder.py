@@ -1,2 +1,11 @@
+import os
+
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+
+
 def get_embeddings(text,model):
-    return model.encode([text]).squeeze()
\ No newline at end of file
+    return model.encode([text]).squeeze()
+
+
+def get_batch_embeddings(texts, model, batch_size=EMBED_BATCH_SIZE):
+    return model.encode(texts, batch_size=batch_size)
@@ -1,53 +1,132 @@
 from preprocessor import preprocess
 from model import get_model
-from embedder import get_embeddings
-from vector_store import prepare_qdrant_point_from_embedding,store_in_vector_store,get_client
+from embedder import get_batch_embeddings
+from vector_store import prepare_qdrant_point_from_embedding,store_in_vector_store
 import uuid
 from qdrant_client.models import Filter, FieldCondition, MatchValue
 from qdrant_client import models
+from common.jobs import get_registry, progress
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# a full sync whose job made no progress for this long never deletes anything
+END_OF_SYNC_TIMEOUT = float(os.getenv("END_OF_SYNC_TIMEOUT", "3600"))
+
+
+class SyncIncomplete(Exception):
+    """The end of a full sync arrived before all of its rows were synced; retry later."""
 
 
 def handle(event, context):
-    ""
+    """
+    Accepts a single product row, a batch envelope {"version": 1,
+    "rows": [...]}, or the end_of_sync control message of a full sync;
+    a single row is treated as a batch of one.
+    """
+    json_payload = event["payload"]
+    if json_payload.get("control") == "end_of_sync":
+        return handle_end_of_sync(json_payload, context)
+    rows = json_payload["rows"] if "rows" in json_payload else [json_payload]
+    job_id = json_payload.get("job_id")
+    try:
+        return handle_batch(rows, context, job_id=job_id, sync_run_id=json_payload.get("sync_run_id"))
+    except Exception:
+        # the batch is acked and dropped: its rows will never be synced
+        record_progress(job_id, rows_failed=len(rows))
+        raise
+
+
+def stored_content_hashes(client, collection_name, ids):
+    """{point id: content_hash} for the products already stored, in one retrieve request."""
+    points = client.retrieve(
+        collection_name=collection_name,
+        ids=ids,
+        with_payload=["content_hash"],
+        with_vectors=False,
+    )
+    return {str(point.id): (point.payload or {}).get("content_hash") for point in points}
+
+
+def handle_batch(rows, context, job_id=None, sync_run_id=None):
+    """
+    Product ids are stable across uploads and double as point ids. Rows
+    whose content hash matches the stored point are skipped before
+    embedding; new and changed rows are embedded and upserted in place.
+    """
     model = context["model"]
     collection_name = context["collection_name"]
     vstore_client = context["client"]
 
-    json_payload = event["payload"]
-    tenant_id = json_payload["tenant_id"]
-    
-    normalized_text = preprocess(json_payload)
-    embeddings = get_embeddings(normalized_text,model)
-    client = get_client()
-    search_result = client.query_points(
-    collection_name=collection_name,
-    query=embeddings,
-    with_payload=True,
-    with_vectors=False,
-    query_filter=models.Filter(
-    should=[
-        models.FieldCondition(
-            key="id",
-            match=models.MatchValue(
-                value=json_payload["id"],
-            ),
-        ),
- 
-    ]
-    ),
-    limit=1,
-    score_threshold=0.3
-    ).points
-
-    if len(search_result) > 0:
+    stored = stored_content_hashes(vstore_client, collection_name, [row["id"] for row in rows])
+    unchanged = [row["id"] for row in rows if row["id"] in stored and stored[row["id"]] == row.get("content_hash")]
+    rows = [row for row in rows if row["id"] not in unchanged]
+
+    if sync_run_id is not None and unchanged:
+        # unchanged products are still part of this full sync
+        vstore_client.set_payload(collection_name=collection_name, payload={"sync_run_id": sync_run_id}, points=unchanged, wait=True)
+    if not rows:
+        record_progress(job_id, rows_skipped=len(unchanged))
         return
 
-    qdrant_point = prepare_qdrant_point_from_embedding(embeddings,{
-        "id":json_payload["id"],
-        "title":json_payload["title"],
-        "tenant_id":tenant_id,
-        "text":normalized_text
-    })
-    operation_response = store_in_vector_store(vstore_client,collection_name=collection_name,qdrant_points=[qdrant_point])
+    normalized_texts = [preprocess(row) for row in rows]
+    # one forward pass per batch instead of one per product
+    embeddings = get_batch_embeddings(normalized_texts, model)
+
+    qdrant_points = []
+    for row, normalized_text, embedding in zip(rows, normalized_texts, embeddings):
+        payload = {
+            "id": row["id"],
+            "title": row.get("title", ""),
+            "tenant_id": row["tenant_id"],
+            "text": normalized_text,
+            "content_hash": row.get("content_hash"),
+        }
+        if sync_run_id is not None:
+            payload["sync_run_id"] = sync_run_id
+        qdrant_points.append(prepare_qdrant_point_from_embedding(embedding, payload))
+
+    operation_response = store_in_vector_store(vstore_client,collection_name=collection_name,qdrant_points=qdrant_points)
+    record_progress(job_id, rows_embedded=len(rows), rows_stored=len(qdrant_points), rows_skipped=len(unchanged))
     return operation_response
 
+
+def handle_end_of_sync(message, context):
+    """
+    Deletes the tenant's products that the full sync did not touch, but
+    only once the job registry shows every row of the job as synced;
+    until then SyncIncomplete asks for the message to be retried. A sync
+    with failed rows is given up at once: products from those rows were
+    not tagged with this run and would be deleted.
+    """
+    job = get_registry().get(message["job_id"])
+    if job is None:
+        # never registered or since removed: it would never become synced, so retrying cannot help
+        logger.warning(f"end of sync for unknown job {message['job_id']}, dropping it")
+        return None
+    if job["rows_failed"]:
+        logger.warning(f"full sync {message['job_id']} has {job['rows_failed']} failed rows, not deleting anything")
+        return None
+    if not progress(job)["synced"]:
+        if time.time() - job["updated_at"] > END_OF_SYNC_TIMEOUT:
+            logger.warning(f"full sync {message['job_id']} stalled with rows missing, not deleting anything")
+            return None
+        raise SyncIncomplete(message["job_id"])
+
+    return context["client"].delete(
+        collection_name=context["collection_name"],
+        points_selector=models.FilterSelector(
+            filter=models.Filter(
+                must=[models.FieldCondition(key="tenant_id", match=models.MatchValue(value=message["tenant_id"]))],
+                must_not=[models.FieldCondition(key="sync_run_id", match=models.MatchValue(value=message["sync_run_id"]))],
+            )
+        ),
+        wait=True,
+    )
+
+
+def record_progress(job_id, **counts):
+    if job_id is not None:
+        get_registry().add_counts(job_id, **counts)
@@ -51,7 +51,8 @@ def prepare_qdrant_point_from_payload_descriptions(model,payloads,get_embeddings
     return points
 
 def prepare_qdrant_point_from_embedding(embedding,payload):
-    id = uuid.uuid4()
+    # the product's stable id, so a re-synced product overwrites its own point
+    id = payload.get("id") or uuid.uuid4()
     point = PointStruct(id=str(id), vector=embedding, payload=payload)
     return point
         